@@ -26,7 +26,47 @@ HOME = os.path.expanduser("~")
 LOCAL = "{}{}".format(HOME, "./appdata/local/innotec")
 APP_DATA = "./appdata"
 DBPATH = APP_DATA + "/app.db"
+BACKUP_PATH = APP_DATA + "/backup"
+TEMPLATE_PATH = "./resources/template.db"  # shipped - built with make template
+TEMPLATE_CACHE = APP_DATA + "/template.db"  # built on first run when the shipped template is missing or stale
 LOGPATH = APP_DATA + "/app.log"
+DB_STORAGE = "disk"  # "memory" keeps one shared in-memory database for the process
+DB_BUSY_TIMEOUT = 5000  # ms sqlite waits for a lock before reporting busy
+DB_BUSY_RETRIES = 5
+DB_BUSY_BACKOFF = 0.05  # s before the first retry - doubled per retry
+DB_STATEMENT_CACHE = 256
+DB_RESULT_CACHE = 256  # select results kept
+DB_RESULT_CACHE_ROWS = 5000  # larger results are read again every time
+DB_BATCH_SIZE = 1000
+DB_FETCH_CHUNK = 500
+DB_IN_LIST_MAX = 500
+DB_PROFILE = "interactive"
+DB_PROFILES = {
+    # auto_vacuum has to come first - a new database takes it only before anything is written
+    "interactive": (("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "NORMAL"),
+                    ("cache_size", -16384), ("mmap_size", 268435456), ("temp_store", "DEFAULT")),
+    "bulk_import": (("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "OFF"),
+                    ("cache_size", -65536), ("mmap_size", 268435456), ("temp_store", "MEMORY"))
+}
+QUERY_PROFILE = True
+QUERY_PROFILE_SAMPLES = 500
+SLOW_QUERY_MS = 100
+DB_MAINTENANCE_IDLE = 120  # s without user input before maintenance runs
+DB_MAINTENANCE_PAUSE = 0.05  # s between maintenance steps - other writers get the database
+DB_OPTIMIZE_HOURS = 24
+DB_INTEGRITY_DAYS = 7
+DB_ANALYSIS_LIMIT = 1000  # rows sampled per index by ANALYZE
+DB_VACUUM_PAGES = 256  # free pages returned per incremental vacuum step
+DB_VACUUM_RATIO = 0.25  # free share of a database without incremental vacuum which justifies a VACUUM at exit
+DB_BACKUP_PAGES = 1024  # pages copied per backup step
+DB_BACKUP_SLEEP = 0.005  # s between backup steps - other connections get the database
+DB_BACKUP_COMPRESSION = 1  # gzip level - fast
+DB_BACKUP_CHUNK = 1048576  # bytes compressed per step
+SETTINGS_FLUSH_DELAY = 0.5  # s settings writes are merged before they are written
+ARCHIVE_KEEP_YEARS = 2  # years kept in the database - the current and the previous year
+ARCHIVE_ATTACH_MAX = 8  # archives attached at a time - sqlite allows 10
+ARCHIVE_LIST_YEARS = 3  # archived years listed with the visits of a customer
+DB_PRAGMAS = ("journal_mode", "auto_vacuum", "synchronous", "cache_size", "mmap_size", "temp_store", "page_size")
 CSV_TABLES = [
     ("Kontakter", "contacts"), ("Kunder", "customers"),
     ("Ordrelinjer", "lines"), ("Rapporter", "reports"),
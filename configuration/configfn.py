@@ -6,12 +6,18 @@
 
 """Configuration functions"""
 
+from models import template
 from util import fileFn
 
 from . import config
 
 
 def check_config_folder():
-    """Checks if the APP_DATA folder exist and creates if not"""
+    """
+    Checks if the APP_DATA folder exist and creates if not
+    A missing database is created as a copy of the template database
+    """
     if not fileFn.check_file(config.APP_DATA, folder=True):
         fileFn.create_dir(config.APP_DATA)
+    if not fileFn.check_file(config.DBPATH):
+        template.install(config.DBPATH)
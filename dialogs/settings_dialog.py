@@ -97,7 +97,8 @@ class SettingsDialog(QDialog, Ui_settingsDialog):
         if len(self._work["mailpass"]) < 97:
             self._work["mailpass"] = passwdFn.hash_password(self._work["mailpass"])
         self._settings.report = self._work
-        self._settings.update()
+        # receivers may read the settings through another instance - write them now
+        self._settings.flush()
         self.settings_changed.emit()
         self.done(True)
 
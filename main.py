@@ -10,12 +10,13 @@ Eordre application module
 
 import datetime
 import os
+import sqlite3
 import sys
 
-from PyQt5.QtCore import QTimer, Qt, QThread, pyqtSlot, QCoreApplication
+from PyQt5.QtCore import QEvent, QTimer, Qt, QThread, pyqtSlot, QCoreApplication
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QSplashScreen, \
-    QTreeWidgetItem, QTableWidgetItem
+from PyQt5.QtWidgets import QApplication, QFileDialog, QMainWindow, QMessageBox, QProgressDialog, \
+    QSplashScreen, QTreeWidgetItem, QTableWidgetItem
 
 from configuration import config, configfn
 
@@ -24,11 +25,15 @@ from dialogs.get_customers_dialog import GetCustomersDialog
 from dialogs.get_pricelist_dialog import GetPricelistDialog
 from dialogs.create_report_dialog import ReportDialogCreate
 
+from models.backup import Backup
 from models.contact import Contact
 from models.customer import Customer
 from models.orderline import OrderLine
 from models.employee import Employee
+from models.maintenance import Maintenance
+from models.model import Model
 from models.product import Product
+from models.query import Query
 from models.report import Report
 from models.settings import Settings
 from models.visit import Visit
@@ -40,6 +45,7 @@ from util import utils
 from util import passwdFn
 from util import printFn
 from util.rules import check_settings
+from util.worker import Worker
 
 __appname__ = "Eordre NG"
 __module__ = "main.py"
@@ -71,6 +77,11 @@ class MainWindow(QMainWindow, Ui_mainWindow):
 
         self.textWorkdate.setText(datetime.date.today().isoformat())  # initialize workdate to current date
 
+        # missing tables and indexes are created in a single transaction
+        # the models are initialized after it - employee may load from http and must not hold the write lock
+        with Query.transaction():
+            for model in Model.models:
+                Query().ensure_schema(model.model)
         self._archivedOrderlines = OrderLine()  # Initialize Detail object
         self._archivedVisits = Visit()  # Initialize Visit object
         self._contacts = Contact()  # Initialize Contact object
@@ -82,6 +93,21 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         self._settings = Settings()  # Initialize Settings object
         self._visits = Visit()
 
+        # database maintenance runs when the user has been idle for a while
+        self._maintenance = None
+        self._maintenance_thread = None
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.setInterval(config.DB_MAINTENANCE_IDLE * 1000)
+        self._idle_timer.timeout.connect(self.start_maintenance)
+        QApplication.instance().installEventFilter(self)
+
+        # database backup runs in a worker thread
+        self._backup = None
+        self._backup_thread = None
+        self._backup_progress = None
+        self._backup_status = ""
+
         self.buttonArchiveContacts.clicked.connect(self.archive_contacts)
         self.buttonArchiveCustomer.clicked.connect(self.archive_customer)
         self.buttonArchiveVisit.clicked.connect(self.archive_visit)
@@ -194,6 +220,17 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         # TODO handle close event
         self.app_exit()
 
+    def eventFilter(self, obj, event):
+        """
+        Restart the idle timer on user input
+        Running maintenance stops after its current step
+        """
+        if event.type() in (QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.Wheel):
+            self._idle_timer.start()
+            if self._maintenance is not None:
+                self._maintenance.stop()
+        return super(MainWindow, self).eventFilter(obj, event)
+
     def display_sync_status(self):
         """
         Update status fields
@@ -239,7 +276,8 @@ class MainWindow(QMainWindow, Ui_mainWindow):
             self.textArchivedVisitNote.setText(
                 self._archivedVisits.visit["visit_note"])
 
-            self._archivedOrderlines.list_ = self._archivedVisits.visit["visit_id"]
+            self._archivedOrderlines.load_visit(self._archivedVisits.visit["visit_id"],
+                                                self._archivedVisits.visit["visit_date"])
             for line in self._archivedOrderlines.list_:
                 item = QTreeWidgetItem([line["linetype"],
                                         str(line["pcs"]),
@@ -312,7 +350,7 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         self.widgetCustomers.clear()  # shake the tree for leaves
         items = []  # temporary list
         try:
-            for c in self._customers.customers:
+            for c in self._customers.iter_customers():  # stream - the list is not needed here
                 item = QTreeWidgetItem([str(c["customer_id"]),
                                         c["account"],
                                         c["phone1"],
@@ -323,10 +361,26 @@ class MainWindow(QMainWindow, Ui_mainWindow):
                 items.append(item)
         except (IndexError, KeyError):
             pass
+        except sqlite3.Error:
+            items = []  # no partial list
         # assign Widgets to Tree
         self.widgetCustomers.addTopLevelItems(items)
         self.widgetCustomers.setSortingEnabled(True)  # enable sorting
 
+    def populate_info_page(self):
+        """
+        Populate info page with the effective database settings
+        """
+        lines = ["Database: {}".format(config.DBPATH),
+                 "Profil: {}".format(Query.connections.profile)]
+        for pragma, value in Query.pragmas().items():
+            lines.append("{}: {}".format(pragma, value))
+        if Query.profiler.enabled:
+            lines.append("")
+            lines.append(Query.profiler.report(limit=10))
+        self.labelAbout.setText("\n".join(lines))
+        self.labelAbout.adjustSize()
+
     def populate_price_list(self):
         """
         Populate widgetPricelist
@@ -491,6 +545,7 @@ class MainWindow(QMainWindow, Ui_mainWindow):
 
         # display known sync data
         self.display_sync_status()
+        self._idle_timer.start()
 
     def set_indexes(self):
         """
@@ -527,7 +582,22 @@ class MainWindow(QMainWindow, Ui_mainWindow):
             self._settings.settings["cust_idx"] = self._customers.customer["customer_id"]
         except KeyError:
             self._settings.settings["cust_idx"] = 0
-        self._settings.update()
+        # pending settings are written now - not by the timer after the connections are closed
+        self._settings.flush()
+        if config.DEBUG_QUERY:
+            printFn.debug(__module__, "connections", Query.connection_stats())
+            printFn.debug(__module__, "results", Query.result_stats())
+        # finish idle maintenance and run the due tasks before the connections close
+        if self._maintenance is not None:
+            self._maintenance.stop()
+        if self._maintenance_thread is not None:
+            self._maintenance_thread[0].wait()
+        if self._backup_thread is not None:
+            self._backup.stop()
+            self._backup_thread[0].wait()
+        Maintenance().run(at_exit=True)
+        Query.profiler.dump()
+        Query.close()
         app.quit()
 
     @pyqtSlot(name="archive_contacts")
@@ -620,7 +690,8 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         self._settings.settings["mailserver"] = self.textExtMailServer.text().lower()
         self._settings.settings["mailport"] = self.textExtMailServerPort.text()
         self._settings.settings["mailuser"] = self.textExtMailServerUser.text()
-        self._settings.update()
+        # the employee reads the settings through its own instance - write them now
+        self._settings.flush()
         self._employees.load(self._settings.settings["usermail"])
         msgbox.information(self, __appname__, "Indstillinger opdateret.", QMessageBox.Ok)
 
@@ -637,7 +708,7 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         self._visits.visit["po_address1"] = self.textVisitDelAddress1.text()
         self._visits.visit["po_address2"] = self.textVisitDelAddress2.text()
         self._visits.visit["po_postcode"] = self.textVisitDelZip.text()
-        self._visits.visit["po_postofffice"] = self.textVisitDelCity.text()
+        self._visits.visit["po_postoffice"] = self.textVisitDelCity.text()
         self._visits.visit["po_country"] = self._employees.employee["country"]
         self._visits.visit["po_note"] = self.textVisitOrderNote.text()
         self._visits.visit["prod_demo"] = self.textVisitProductDemo.text()
@@ -886,7 +957,6 @@ class MainWindow(QMainWindow, Ui_mainWindow):
             if factor is not 0.0:
                 item["price"] = item["price"] * factor
                 item["d2"] = item["d2"] * factor
-                item["d3"] = item["d3"] * factor
                 item["d4"] = item["d4"] * factor
                 item["d6"] = item["d6"] * factor
                 item["d8"] = item["d8"] * factor
@@ -910,24 +980,80 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         """
         Export Database backup file
         """
-        # TODO: Create CSV data backup
-        msgbox = QMessageBox()
-        msgbox.information(self,
-                           __appname__,
-                           "TODO: Create Database Backup File",
-                           QMessageBox.Ok)
+        if self._backup_thread is not None and self._backup_thread[0].isRunning():
+            return
+        filename, _ = QFileDialog.getSaveFileName(self,
+                                                  "Gem database backup",
+                                                  Backup.filename(config.HOME),
+                                                  "Database backup (*.db.gz)")
+        if not filename:
+            return
+        # pending settings belong in the backup
+        self._settings.flush()
+        # the copy runs in a worker thread - the app stays usable meanwhile
+        backup = Backup()
+        progress = QProgressDialog("Gemmer database backup ...", "Afbryd", 0, 100, self)
+        progress.setWindowModality(Qt.NonModal)
+        progress.setMinimumDuration(0)
+        progress.canceled.connect(backup.stop)
+        worker = Worker(40, app, args=(backup, filename))
+        thread = QThread(self)
+        thread.setObjectName("database_export")
+        worker.moveToThread(thread)
+        worker.sig_progress.connect(self.on_backup_progress)
+        worker.sig_status.connect(self.on_backup_status)
+        worker.sig_done.connect(thread.quit)
+        worker.sig_done.connect(self.on_backup_done)
+        thread.started.connect(worker.export_database)
+        self._backup = backup
+        self._backup_progress = progress
+        self._backup_thread = (thread, worker)
+        thread.start()
 
     @pyqtSlot(name="data_import")
     def data_import(self):
         """
         Import Database backup file
         """
-        # TODO: Restore from CSV data backup
+        if self._backup_thread is not None and self._backup_thread[0].isRunning():
+            return
+        filename, _ = QFileDialog.getOpenFileName(self,
+                                                  "Vælg database backup",
+                                                  config.HOME,
+                                                  "Database backup (*.db.gz *.db)")
+        if not filename:
+            return
         msgbox = QMessageBox()
-        msgbox.information(self,
-                           __appname__,
-                           "TODO: Import Database Backup File",
-                           QMessageBox.Ok)
+        answer = msgbox.question(self,
+                                 __appname__,
+                                 "Alle eksisterende data erstattes af data fra backup!\n\nFortsæt?",
+                                 QMessageBox.Yes | QMessageBox.No)
+        if not answer == QMessageBox.Yes:
+            return
+        # the database is replaced - pending settings must not be written into the restored one
+        # they are written to the current database first and kept if the restore fails
+        self._settings.flush()
+        self._settings.discard()
+        # the app waits for the worker
+        backup = Backup()
+        progress = QProgressDialog("Indlæser database backup ...", "Afbryd", 0, 100, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.canceled.connect(backup.stop)
+        worker = Worker(50, app, args=(backup, filename))
+        thread = QThread(self)
+        thread.setObjectName("database_import")
+        worker.moveToThread(thread)
+        worker.sig_progress.connect(self.on_backup_progress)
+        worker.sig_status.connect(self.on_backup_status)
+        worker.sig_done.connect(thread.quit)
+        worker.sig_done.connect(self.on_backup_done)
+        worker.sig_done.connect(self.on_restore_done)
+        thread.started.connect(worker.import_database)
+        self._backup = backup
+        self._backup_progress = progress
+        self._backup_thread = (thread, worker)
+        thread.start()
 
     @pyqtSlot(name="get_customers")
     def get_customers(self):
@@ -999,35 +1125,64 @@ class MainWindow(QMainWindow, Ui_mainWindow):
             current: currently selected item
             previous: previous selected item
         """
-        try:
-            # account = current.text(0)
-            phone = current.text(2)
-            company = current.text(4)
-            # load customer
-            self._customers.lookup(phone, company)
-            # fill out fields
-            self.textAccount.setText(self._customers.customer["account"])
-            self.textCompany.setText(self._customers.customer["company"])
-            self.textAddress1.setText(self._customers.customer["address1"])
-            self.textAddress2.setText(self._customers.customer["address2"])
-            self.textZipCode.setText(self._customers.customer["zipcode"])
-            self.textCityName.setText(self._customers.customer["city"])
-            self.textPhone1.setText(self._customers.customer["phone1"])
-            self.textPhone2.setText(self._customers.customer["phone2"])
-            self.textEmail.setText(self._customers.customer["email"])
-            self.textFactor.setText(str(self._customers.customer["factor"]))
-            self.textCustomerNotes.setText(self._customers.customer["infotext"])
-            self.textCustomerNameCreateVisit.setText(self._customers.customer["company"])
-        except AttributeError:
-            pass
-        except KeyError:
-            pass
-        # load customer infos
-        self.populate_contact_list()
-        self.populate_archived_visits()
+        # customer, contacts and visits are read from one snapshot while an import runs
+        with Query.snapshot():
+            try:
+                # account = current.text(0)
+                phone = current.text(2)
+                company = current.text(4)
+                # load customer
+                self._customers.lookup(phone, company)
+                # fill out fields
+                self.textAccount.setText(self._customers.customer["account"])
+                self.textCompany.setText(self._customers.customer["company"])
+                self.textAddress1.setText(self._customers.customer["address1"])
+                self.textAddress2.setText(self._customers.customer["address2"])
+                self.textZipCode.setText(self._customers.customer["zipcode"])
+                self.textCityName.setText(self._customers.customer["city"])
+                self.textPhone1.setText(self._customers.customer["phone1"])
+                self.textPhone2.setText(self._customers.customer["phone2"])
+                self.textEmail.setText(self._customers.customer["email"])
+                self.textFactor.setText(str(self._customers.customer["factor"]))
+                self.textCustomerNotes.setText(self._customers.customer["infotext"])
+                self.textCustomerNameCreateVisit.setText(self._customers.customer["company"])
+            except AttributeError:
+                pass
+            except KeyError:
+                pass
+            # load customer infos
+            self.populate_contact_list()
+            self.populate_archived_visits()
         self.populate_archived_visit_details()
         self.load_visit()
 
+    @pyqtSlot(int, name="on_backup_done")
+    def on_backup_done(self, worker_id):
+        """
+        Slot for backup worker done signal
+        """
+        self._backup_progress.close()
+        msgbox = QMessageBox()
+        msgbox.information(self,
+                           __appname__,
+                           self._backup_status,
+                           QMessageBox.Ok)
+
+    @pyqtSlot(int, int, name="on_backup_progress")
+    def on_backup_progress(self, worker_id, percent):
+        """
+        Slot for backup worker progress signal
+        """
+        self._backup_progress.setValue(percent)
+
+    @pyqtSlot(int, str, name="on_backup_status")
+    def on_backup_status(self, worker_id, text):
+        """
+        Slot for backup worker status signal
+        """
+        self._backup_status = text
+        self._backup_progress.setLabelText(text)
+
     @pyqtSlot(name="on_csv_import_done")
     def on_csv_import_done(self):
         """
@@ -1035,6 +1190,22 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         """
         self.populate_customer_list()
 
+    @pyqtSlot(int, name="on_restore_done")
+    def on_restore_done(self, worker_id):
+        """
+        Slot for database import done signal
+        Loaded data belongs to the replaced database
+        """
+        for model in (self._archivedOrderlines, self._archivedVisits, self._contacts, self._orderLines,
+                      self._products, self._reports, self._visits):
+            model.clear()
+        # changes made while the restore ran belong to the replaced database
+        self._settings.discard()
+        self._settings.get()
+        self._customers.load()
+        self.populate_customer_list()
+        self.display_sync_status()
+
     @pyqtSlot(QTreeWidgetItem, name="on_customer_clicked")
     def on_customer_double_clicked(self, current):
         """
@@ -1076,7 +1247,7 @@ class MainWindow(QMainWindow, Ui_mainWindow):
             previous:
         """
         try:
-            self._archivedVisits.load_visit(current.text(0))
+            self._archivedVisits.load_visit(current.text(0), current.text(1))  # id and visit date
         except AttributeError:
             pass
         except KeyError:
@@ -1156,12 +1327,31 @@ class MainWindow(QMainWindow, Ui_mainWindow):
         self.set_indexes()
         self.widgetAppPages.setCurrentIndex(PAGE_CUSTOMERS)
 
+    @pyqtSlot(name="start_maintenance")
+    def start_maintenance(self):
+        """
+        Run database maintenance in a worker thread
+        """
+        if self._maintenance_thread is not None and self._maintenance_thread[0].isRunning():
+            return
+        maintenance = Maintenance()
+        worker = Worker(90, app, args=(maintenance,))
+        thread = QThread(self)
+        thread.setObjectName("maintenance")
+        worker.moveToThread(thread)
+        worker.sig_done.connect(thread.quit)
+        thread.started.connect(worker.database_maintenance)
+        self._maintenance = maintenance
+        self._maintenance_thread = (thread, worker)
+        thread.start()
+
     @pyqtSlot(name="show_page_info")
     def show_page_info(self):
         """
         Show page with about Qt and Eordre
         """
         self.set_indexes()
+        self.populate_info_page()
         self.widgetAppPages.setCurrentIndex(PAGE_INFO)
 
     @pyqtSlot(name="show_page_pricelist")
@@ -1216,11 +1406,12 @@ class MainWindow(QMainWindow, Ui_mainWindow):
                                "Alle salgsdata slettes<br/>Vil du fortsætte?", confirm.Yes | confirm.No)
 
         if val == confirm.Yes:
-            self._contacts.recreate_table()
-            self._customers.recreate_table()
-            self._archivedOrderlines.recreate_table()
-            self._archivedVisits.recreate_table()
-            self._reports.recreate_table()
+            with Query.transaction():
+                self._contacts.recreate_table()
+                self._customers.recreate_table()
+                self._archivedOrderlines.recreate_table()
+                self._archivedVisits.recreate_table()
+                self._reports.recreate_table()
 
             self.populate_contact_list()
             self.populate_archived_visit_details()
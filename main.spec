@@ -1,12 +1,20 @@
 # -*- mode: python -*-
 
+import os
+import subprocess
+import sys
+
 block_cipher = None
 
+# the template database is not committed - build it for the bundle
+if not os.path.exists('resources/template.db'):
+    subprocess.check_call([sys.executable, '-m', 'models.template', 'resources/template.db'])
+
 
 a = Analysis(['main.py'],
              pathex=['/home/fh/Data/personal/sources/eordre3'],
              binaries=[],
-             datas=[],
+             datas=[('resources/template.db', 'resources')],
              hiddenimports=[],
              hookspath=[],
              runtime_hooks=[],
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Yearly archive module"""
+
+import glob
+import os
+import re
+import sqlite3
+import threading
+from datetime import date
+
+from configuration import config
+from models.builders.build_create_query import build_create_query
+from models.builders.build_index_query import build_index_query
+from models.builders.build_select_query import build_select_query
+
+__module__ = "archive"
+
+_YEAR = re.compile(r"archive_(\d{4})\.db$")
+
+
+def schema_name(year):
+    """
+    Name an archive is attached as
+    Args:
+        year:
+    Returns:
+        archive_YYYY
+    """
+    return "archive_{}".format(year)
+
+
+class ArchiveManager:
+    """
+    Closed years of a dated table and its child tables kept in archive_YYYY.db
+    next to the database file
+    Archives are written on the writer connection and read on a connection of their own
+    which attaches the years a query needs - the least recently used year is
+    detached when config.ARCHIVE_ATTACH_MAX years are attached
+    """
+
+    def __init__(self, connections):
+        """
+        Initialize ArchiveManager class
+        Args:
+            connections: ConnectionManager holding the writer
+        """
+        self._connections = connections
+        self._lock = threading.RLock()
+        self._db = None
+        self._attached = []
+        self._years = None
+
+    @staticmethod
+    def path(year):
+        """
+        Archive file for a year
+        Args:
+            year:
+        Returns:
+            path next to config.DBPATH
+        """
+        folder = os.path.dirname(config.DBPATH) or "."
+        return os.path.join(folder, "{}.db".format(schema_name(year)))
+
+    def years(self):
+        """
+        Archived years
+        Returns:
+            sorted list of years with an archive file
+        """
+        with self._lock:
+            if self._years is None:
+                found = (_YEAR.search(name) for name in glob.glob(self.path("*")))
+                self._years = sorted(int(match.group(1)) for match in found if match)
+            return list(self._years)
+
+    @staticmethod
+    def closed():
+        """
+        First year kept in the database - earlier years are closed
+        Returns:
+            year
+        """
+        return date.today().year - config.ARCHIVE_KEEP_YEARS + 1
+
+    def between(self, start=None, end=None):
+        """
+        Archived years a date range touches
+        Args:
+            start: iso date or None for the first archive
+            end: iso date or None for the last archive
+        Returns:
+            list of years
+        """
+        first = int(start[:4]) if start else 0
+        last = int(end[:4]) if end else 9999
+        return [year for year in self.years() if first <= year <= last]
+
+    def move(self, year, model, date_field, children=()):
+        """
+        Move the rows of a year to its archive
+        Rows are copied and deleted in one transaction on the writer
+        Call outside a transaction block - sqlite cannot attach inside one
+        Args:
+            year: year to archive
+            model: table model with the date field
+            date_field: iso date field deciding the year
+            children: tuple of (model, key) for tables with rows belonging to model rows by key
+        Returns:
+            number of model rows moved
+        """
+        schema = schema_name(year)
+        period = ("{}-01-01".format(year), "{}-01-01".format(year + 1))
+        within = "SELECT {} FROM main.{} WHERE {} >= ? AND {} < ?"
+        with self._connections.acquire(write=True) as db:
+            db.execute("ATTACH DATABASE ? AS {};".format(schema), (self.path(year),))
+            try:
+                with self._connections.transaction():
+                    # child rows are found through the model rows - they go first
+                    rows = within.format(model["id"], model["name"], date_field, date_field)
+                    tables = [(child, "{} IN ({})".format(key, rows)) for child, key in children]
+                    tables.append((model, "{} >= ? AND {} < ?".format(date_field, date_field)))
+                    for table, where in tables:
+                        self.__create(db, schema, table)
+                        fields = ", ".join(table["fields"])
+                        # replace - a move which stopped between the two files can be repeated
+                        db.execute("INSERT OR REPLACE INTO {}.{} ({}) SELECT {} FROM main.{} WHERE {};".format(
+                            schema, table["name"], fields, fields, table["name"], where), period)
+                    for table, where in tables:
+                        moved = db.execute("DELETE FROM main.{} WHERE {};".format(table["name"], where),
+                                           period).rowcount
+            finally:
+                db.execute("DETACH DATABASE {};".format(schema))
+        with self._lock:
+            self._years = None
+        return moved
+
+    def select(self, model, selection=None, filters=None, values=(), years=None):
+        """
+        Rows from the archived years in one statement
+        Args:
+            model: table model
+            selection: optional list of fields to return
+            filters: optional filters - see Query.build
+            values: values for the filters
+            years: archived years to read - all years if None
+        Returns:
+            list of row tuples
+        """
+        known = self.years()
+        years = known if years is None else [year for year in years if year in known]
+        result = []
+        for idx in range(0, len(years), config.ARCHIVE_ATTACH_MAX):
+            chunk = years[idx:idx + config.ARCHIVE_ATTACH_MAX]
+            sql = " UNION ALL ".join(
+                build_select_query(dict(model, name="{}.{}".format(schema_name(year), model["name"])),
+                                   selection=selection, filters=filters)[:-1]
+                for year in chunk)
+            with self._lock:
+                db = self.__reader(chunk)
+                try:
+                    result.extend(db.execute("{};".format(sql), tuple(values) * len(chunk)).fetchall())
+                except sqlite3.OperationalError:
+                    # an archive without the table holds no rows for it
+                    continue
+        return result
+
+    def close(self):
+        """
+        Close the archive connection
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+            self._attached = []
+            self._years = None
+
+    def __reader(self, years):
+        """
+        Archive connection with years attached
+        """
+        if self._db is None:
+            self._db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        for year in years:
+            if year in self._attached:
+                self._attached.remove(year)
+            else:
+                if len(self._attached) >= config.ARCHIVE_ATTACH_MAX:
+                    self._db.execute("DETACH DATABASE {};".format(schema_name(self._attached.pop(0))))
+                self._db.execute("ATTACH DATABASE ? AS {};".format(schema_name(year)), (self.path(year),))
+            self._attached.append(year)
+        return self._db
+
+    @staticmethod
+    def __create(db, schema, model):
+        """
+        Create table and indexes of a model in an attached archive
+        """
+        db.execute(build_create_query(dict(model, name="{}.{}".format(schema, model["name"]))))
+        for index in model.get("indexes", ()):
+            db.execute(build_index_query(model, index, schema))
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Database backup module"""
+
+import gzip
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+from configuration import config
+from models.archive import ArchiveManager, schema_name
+from models.builders.build_create_query import build_create_query
+from models.model import Model
+from models.query import Query
+
+__module__ = "backup"
+
+MANIFEST_TABLE = "backup_manifest"
+MANIFEST_MODEL = {
+    "name": MANIFEST_TABLE,
+    "fields": ("table_name", "row_count", "created"),
+    "types": ("TEXT PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "TEXT NOT NULL")
+}
+ARCHIVES_TABLE = "backup_archives"  # archived years backed up next to the database backup
+ARCHIVES_MODEL = {
+    "name": ARCHIVES_TABLE,
+    "fields": ("year",),
+    "types": ("INTEGER PRIMARY KEY NOT NULL",)
+}
+COPY_SHARE = 90  # percent of the progress used by the page copy - the rest is compression
+GZIP_MAGIC = b"\x1f\x8b"
+BACKUP_SUFFIXES = (".db.gz", ".db")
+ARCHIVE_BACKUP = re.compile(r"\.archive_\d{4}\.db(\.gz)?$")
+
+
+def span(progress, low, high):
+    """
+    Progress callable reporting a part of the whole
+    Args:
+        progress: callable receiving percent done or None
+        low: percent at the start of the part
+        high: percent at the end of the part
+    Returns:
+        callable mapping 0-100 to low-high or None
+    """
+    if not progress:
+        return None
+    return lambda percent: progress(low + percent * (high - low) // 100)
+
+
+class BackupInvalid(Exception):
+    """
+    Raised when a backup file fails verification
+    """
+
+
+class BackupStopped(Exception):
+    """
+    Raised when a backup is stopped before it is done
+    """
+
+
+class Backup:
+    """
+    Online backup and restore of the database
+    Pages are copied in chunks with the sqlite backup api from a read snapshot
+    Writers keep working meanwhile and the copy is consistent as of its start
+    The copy carries a manifest with the row count of every table and is written gzip compressed
+    Every archived year is backed up the same way to a file of its own next to the backup
+    A restore is verified against the manifests before it replaces the database and its archives
+    """
+
+    def __init__(self):
+        """
+        Initialize Backup class
+        """
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        Stop after the running step
+        """
+        self._stop.set()
+
+    @staticmethod
+    def filename(folder=None):
+        """
+        Default name for a backup file
+        Args:
+            folder: optional folder - default is config.BACKUP_PATH
+        Returns:
+            path
+        """
+        name = "eordre_{}.db.gz".format(datetime.today().strftime("%Y%m%d_%H%M%S"))
+        return os.path.join(folder or config.BACKUP_PATH, name)
+
+    @staticmethod
+    def archive_filename(backup, year):
+        """
+        Backup file of an archived year belonging to a backup
+        Args:
+            backup: backup file of the database
+            year:
+        Returns:
+            path next to backup - eordre_YYYYMMDD_HHMMSS.archive_YYYY.db.gz
+        """
+        root, suffix = backup, ""
+        for ending in BACKUP_SUFFIXES:
+            if backup.endswith(ending):
+                root, suffix = backup[:-len(ending)], ending
+                break
+        return "{}.{}{}".format(root, schema_name(year), suffix)
+
+    def export(self, target, progress=None):
+        """
+        Write a compressed backup of the database and its archives
+        Args:
+            target: backup file
+            progress: optional callable receiving percent done
+        Returns:
+            tuple with success and target or the error
+        """
+        folder = os.path.dirname(os.path.abspath(target))
+        os.makedirs(folder, exist_ok=True)
+        years = Query.archives.years()
+        files = [("main", target)] + [(schema_name(year), self.archive_filename(target, year)) for year in years]
+        copies = {}
+        try:
+            for schema, _ in files:
+                handle, copies[schema] = tempfile.mkstemp(suffix=".db", dir=folder)
+                os.close(handle)
+            self.__copy(copies, years, span(progress, 0, COPY_SHARE))
+            share = (100 - COPY_SHARE) / len(files)
+            for idx, (schema, out) in enumerate(files):
+                self.__compress(copies[schema], out,
+                                span(progress, COPY_SHARE + int(idx * share), COPY_SHARE + int((idx + 1) * share)))
+        except (sqlite3.DatabaseError, OSError, BackupStopped) as e:
+            return False, e
+        finally:
+            for copy in copies.values():
+                os.remove(copy)
+        return True, target
+
+    def restore(self, source, progress=None):
+        """
+        Replace the database and its archives with a backup
+        The backup and the backups of its archived years are unpacked to temporary files next
+        to the database and verified with integrity_check and their manifests - the database is
+        only replaced when all of them pass
+        Archives not in the backup are removed - their rows are in the restored database
+        Args:
+            source: backup file - compressed or plain
+            progress: optional callable receiving percent done
+        Returns:
+            tuple with success and source or the error
+        """
+        folder = os.path.dirname(os.path.abspath(config.DBPATH))
+        os.makedirs(folder, exist_ok=True)
+        copies = {}
+        try:
+            if ARCHIVE_BACKUP.search(source):
+                raise BackupInvalid("backup of an archived year - choose the database backup next to it")
+            copies[None] = self.__unpack(source, folder, span(progress, 0, COPY_SHARE // 2))
+            years = self.__verify(copies[None])
+            if years is None:
+                if Query.archives.years():
+                    raise BackupInvalid("the backup holds no archives - restoring it would mix its rows "
+                                        "with the archived years")
+                years = []
+            for idx, year in enumerate(years):
+                archive = self.archive_filename(source, year)
+                if not os.path.exists(archive):
+                    raise BackupInvalid("archive {} is missing - expected {}".format(year, archive))
+                part = span(progress, COPY_SHARE // 2 + idx * COPY_SHARE // (2 * len(years)),
+                            COPY_SHARE // 2 + (idx + 1) * COPY_SHARE // (2 * len(years)))
+                copies[year] = self.__unpack(archive, folder, part)
+                if self.__verify(copies[year]) is not None:
+                    raise BackupInvalid("archive {} is not an archive backup".format(year))
+            if progress:
+                progress(COPY_SHARE)
+            self.__swap(copies)
+        except (sqlite3.DatabaseError, OSError, EOFError, BackupStopped, BackupInvalid) as e:
+            return False, e
+        finally:
+            for copy in copies.values():
+                if os.path.exists(copy):
+                    os.remove(copy)
+        if progress:
+            progress(100)
+        return True, source
+
+    def __copy(self, copies, years, progress):
+        """
+        Copy the database and the archives page by page into copies and add the manifests
+        """
+        src = Query.connections.connect()
+        try:
+            for year in years:
+                src.execute("ATTACH DATABASE ? AS {};".format(schema_name(year)), (ArchiveManager.path(year),))
+            # a read transaction pins the snapshot - without it every write
+            # by another connection restarts the copy
+            # reading every file at once keeps a move to an archive out of the copy or wholly in it
+            src.execute("BEGIN;")
+            schemas = list(copies)
+            tables = {schema: [name for name, in src.execute(
+                "SELECT name FROM {}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';".format(schema))]
+                for schema in schemas}
+            created = datetime.today().isoformat()
+            for idx, schema in enumerate(schemas):
+                part = span(progress, idx * 100 // len(schemas), (idx + 1) * 100 // len(schemas))
+                dst = sqlite3.connect(copies[schema], isolation_level=None)
+                try:
+                    def step(status, remaining, total):
+                        if self._stop.is_set():
+                            raise BackupStopped()
+                        if part and total:
+                            part((total - remaining) * 100 // total)
+
+                    src.backup(dst, pages=config.DB_BACKUP_PAGES, progress=step, name=schema,
+                               sleep=config.DB_BACKUP_SLEEP)
+                    dst.execute(build_create_query(MANIFEST_MODEL))
+                    dst.executemany(
+                        "INSERT OR REPLACE INTO {} (table_name, row_count, created) VALUES (?, ?, ?);".format(
+                            MANIFEST_TABLE),
+                        [(table, src.execute("SELECT count(*) FROM {}.{};".format(schema, table)).fetchone()[0],
+                          created) for table in tables[schema]])
+                    if schema == "main":
+                        dst.execute(build_create_query(ARCHIVES_MODEL))
+                        dst.executemany("INSERT INTO {} (year) VALUES (?);".format(ARCHIVES_TABLE),
+                                        [(year,) for year in years])
+                finally:
+                    dst.close()
+            src.execute("COMMIT;")
+        finally:
+            src.close()
+
+    def __compress(self, copy, target, progress):
+        """
+        Gzip copy to target - target is replaced when complete
+        """
+        total = os.path.getsize(copy) or 1
+        part = "{}.part".format(target)
+        done = 0
+        try:
+            with open(copy, "rb") as source, gzip.open(part, "wb", compresslevel=config.DB_BACKUP_COMPRESSION) as out:
+                while True:
+                    if self._stop.is_set():
+                        raise BackupStopped()
+                    chunk = source.read(config.DB_BACKUP_CHUNK)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(done * 100 // total)
+            os.replace(part, target)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+
+    def __unpack(self, source, folder, progress):
+        """
+        Unpack a backup file into a temporary file in folder
+        Returns:
+            path of the temporary file - the caller removes it
+        """
+        handle, copy = tempfile.mkstemp(suffix=".db", dir=folder)
+        os.close(handle)
+        try:
+            with open(source, "rb") as f:
+                compressed = f.read(2) == GZIP_MAGIC
+            if compressed:
+                self.__decompress(source, copy, progress)
+            else:
+                self.__load(source, copy, progress)
+        except BaseException:
+            os.remove(copy)
+            raise
+        return copy
+
+    def __decompress(self, source, copy, progress):
+        """
+        Unpack a compressed backup into copy
+        """
+        total = os.path.getsize(source) or 1
+        with open(source, "rb") as raw, gzip.GzipFile(fileobj=raw) as packed, open(copy, "wb") as out:
+            while True:
+                if self._stop.is_set():
+                    raise BackupStopped()
+                chunk = packed.read(config.DB_BACKUP_CHUNK)
+                if not chunk:
+                    break
+                out.write(chunk)
+                if progress:
+                    progress(raw.tell() * 100 // total)
+
+    def __load(self, source, copy, progress):
+        """
+        Copy a plain backup into copy with the backup api
+        """
+        src = sqlite3.connect("file:{}?mode=ro".format(source), uri=True)
+        dst = sqlite3.connect(copy)
+        try:
+            def step(status, remaining, total):
+                if self._stop.is_set():
+                    raise BackupStopped()
+                if progress and total:
+                    progress((total - remaining) * 100 // total)
+
+            src.backup(dst, pages=config.DB_BACKUP_PAGES, progress=step)
+        finally:
+            dst.close()
+            src.close()
+
+    @staticmethod
+    def __verify(copy):
+        """
+        Check an unpacked backup and drop its manifest
+        Returns:
+            archived years backed up with the database - None for a backup without the list
+        """
+        db = sqlite3.connect(copy, isolation_level=None)
+        try:
+            result = db.execute("PRAGMA integrity_check;").fetchone()[0]
+            if result != "ok":
+                raise BackupInvalid("integrity check failed: {}".format(result))
+            tables = {name for name, in db.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+            if MANIFEST_TABLE not in tables:
+                raise BackupInvalid("no manifest - not a backup made by this app")
+            for table, rows in db.execute("SELECT table_name, row_count FROM {};".format(MANIFEST_TABLE)).fetchall():
+                if table not in tables:
+                    raise BackupInvalid("table {} is missing".format(table))
+                count = db.execute("SELECT count(*) FROM {};".format(table)).fetchone()[0]
+                if count != rows:
+                    raise BackupInvalid("table {} has {} rows - expected {}".format(table, count, rows))
+            db.execute("DROP TABLE {};".format(MANIFEST_TABLE))
+            if ARCHIVES_TABLE not in tables:
+                return None
+            years = [year for year, in db.execute("SELECT year FROM {} ORDER BY year;".format(ARCHIVES_TABLE))]
+            db.execute("DROP TABLE {};".format(ARCHIVES_TABLE))
+            return years
+        finally:
+            db.close()
+
+    @staticmethod
+    def __swap(copies):
+        """
+        Put the verified copies in place of the database and its archives and reopen the connections
+        Args:
+            copies: dict with the database copy under None and the archive copies under their year
+        """
+        with Query.connections.acquire(write=True) as db:
+            if Query.connections.storage == "memory":
+                src = sqlite3.connect(copies[None])
+                try:
+                    src.backup(db)
+                finally:
+                    src.close()
+            else:
+                # an empty wal - nothing of the old database can be replayed into the new one
+                db.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+            Query.close()
+            if Query.connections.storage != "memory":
+                Backup.__replace(copies[None], config.DBPATH)
+            for year in Query.archives.years():
+                if year not in copies:
+                    Backup.__replace(None, ArchiveManager.path(year))
+            for year, copy in copies.items():
+                if year is not None:
+                    Backup.__replace(copy, ArchiveManager.path(year))
+            # readers opened on another thread meanwhile still see the old files
+            Query.close()
+        # a backup of an older version is migrated at once
+        for model in Model.models:
+            Query().ensure_schema(model.model)
+
+    @staticmethod
+    def __replace(copy, path):
+        """
+        Move copy to path and remove the journal files of the file it replaces
+        Args:
+            copy: file to put in place - None removes path
+            path: database file
+        """
+        if copy is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            os.replace(copy, path)
+        for suffix in ("-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
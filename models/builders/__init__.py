@@ -4,4 +4,4 @@
 # Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-__all__ = ("create_query", "delete_query", "insert_query", "select_query", "update_query")
+__all__ = ("create_query", "delete_query", "insert_query", "select_query", "update_query", "upsert_query")
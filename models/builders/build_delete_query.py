@@ -10,12 +10,14 @@ def build_delete_query(model, filters):
     Builds a query for supplied model
     Args:
         model:
-        filters: required list of one or more fields to filter on
+        filters: list of one or more fields to filter on - without filters all rows are deleted
 
     Returns:
         valid sql statement for model
     """
     name = model["name"]
+    if not filters:
+        return "DELETE FROM {};".format(name)
     whr_count = len(filters)
     string = ""
     # where 'field' operator
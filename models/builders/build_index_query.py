@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+
+def index_definition(index):
+    """
+    Normalize an index entry from a model definition
+    Args:
+        index: tuple of field names
+               or dict {"fields": ("field" ...), "unique": bool, "where": "expression"}
+
+    Returns:
+        tuple with fields, unique and where
+    """
+    if isinstance(index, dict):
+        return tuple(index["fields"]), bool(index.get("unique", False)), index.get("where", "")
+    return tuple(index), False, ""
+
+
+def index_name(model, index):
+    """
+    Name for an index on model
+    Args:
+        model:
+        index:
+
+    Returns:
+        index name - idx_table_field_field or uix_table_field_field for unique indexes
+    """
+    fields, unique, where = index_definition(index)
+    prefix = "uix" if unique else "idx"
+    return "{}_{}_{}".format(prefix, model["name"], "_".join(fields))
+
+
+def build_index_query(model, index, schema=None):
+    """
+    Builds a query for supplied model
+    Args:
+        model:
+        index: index entry from the model "indexes" list
+        schema: optional name of an attached database holding the table
+
+    Returns:
+        valid sql statement for model
+    """
+    fields, unique, where = index_definition(index)
+    name = model["name"]
+    string = "CREATE UNIQUE INDEX" if unique else "CREATE INDEX"
+    idx_name = index_name(model, index)
+    if schema:
+        idx_name = "{}.{}".format(schema, idx_name)
+    string = "{} IF NOT EXISTS {} ON {} ({})".format(string, idx_name, name, ", ".join(fields))
+    if where:
+        string = "{} WHERE {}".format(string, where)
+    return "{};".format(string)
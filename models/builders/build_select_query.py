@@ -5,7 +5,53 @@
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
 
-def build_select_query(model, selection=None, aggregates=None, filters=None, orderby=None):
+def build_condition(field, operator):
+    """
+    Builds a single where condition
+    Args:
+        field: field name
+        operator: comparison operator
+                  "between" for a range using two values
+                  ("in", count) for a list of count values
+
+    Returns:
+        condition with ? placeholders
+    """
+    if isinstance(operator, (list, tuple)):
+        operator, count = operator[0].upper(), int(operator[1])
+        if operator == "IN" or operator == "NOT IN":
+            # an empty list is valid and matches nothing
+            return "{} {} ({})".format(field, operator, ", ".join(["?"] * count))
+        raise ValueError("Unsupported list operator: {}".format(operator))
+    operator = operator.upper()
+    if operator == "BETWEEN" or operator == "NOT BETWEEN":
+        return "{} {} ? AND ?".format(field, operator)
+    return "{} {} ?".format(field, operator)
+
+
+def build_orderby(orderby):
+    """
+    Builds the order by part
+    Args:
+        orderby: (field, direction) or a list of (field, direction)
+
+    Returns:
+        comma separated list of field direction
+    """
+    if not orderby:
+        return ""
+    if isinstance(orderby[0], str):
+        orderby = [orderby]
+    terms = []
+    for item in orderby:
+        direction = item[1].upper() if len(item) > 1 else "ASC"
+        if direction not in ("ASC", "DESC"):
+            direction = "ASC"
+        terms.append("{} {}".format(item[0], direction))
+    return ", ".join(terms)
+
+
+def build_select_query(model, selection=None, aggregates=None, filters=None, orderby=None, limit=None, offset=None):
     """
     Builds a query for supplied model
     Args:
@@ -13,7 +59,9 @@ def build_select_query(model, selection=None, aggregates=None, filters=None, ord
         selection: optional list of fields to return
         aggregates: optional list of one or more valid aggregates
         filters: optional list of one or more fields to filter query
-        orderby: optional sort_order
+        orderby: optional (field, direction) or list of (field, direction)
+        limit: optional max number of rows
+        offset: optional number of rows to skip - without limit all remaining rows are returned
 
     Returns:
         valid sql statement for model
@@ -25,79 +73,36 @@ def build_select_query(model, selection=None, aggregates=None, filters=None, ord
     if selection:
         fields = selection
     name = model["name"]
-    field_count = len(fields)
-    aggregate_count = 0
     where_count = 0
-    result_orderby_field = ""
-    result_order_direction = ""
-    sql_aggregates = ""
     sql_wheres = ""
-    sql_filters = ""
 
     if aggregates:
-        aggregate_count = len(aggregates)
-    if filters:
-        where_count = len(filters)
-    if orderby:
-        result_orderby_field = orderby[0]
-        result_order_direction = orderby[1]
-
-    # aggregate list values
-    if aggregates:
-        for idx, aggregate in enumerate(aggregates):
-            if (idx + 1) == aggregate_count:
-                sql_aggregates = sql_aggregates + "{}".format(aggregate)
-            else:
-                sql_aggregates = sql_aggregates + "{}, ".format(aggregate)
+        sql_columns = ", ".join(aggregates)
     else:
-        for idx, field in enumerate(fields):
-            if (idx + 1) == field_count:
-                sql_filters = sql_filters + "{} ".format(field)
-            else:
-                sql_filters = sql_filters + "{}, ".format(field)
+        sql_columns = ", ".join(fields)
 
     # where 'field' operator 'value'
     if filters:
+        where_count = len(filters)
         for idx, s_item in enumerate(filters):
-            field = s_item[0]
-            operator = s_item[1].upper()
-            andor = ""
+            condition = build_condition(s_item[0], s_item[1])
+            andor = "AND"
             if len(s_item) == 3:
-                andor = s_item[2]
+                andor = s_item[2].upper()
             if (idx + 1) == where_count:
-                sql_wheres = sql_wheres + " {} {} ?".format(field, operator)
+                sql_wheres = sql_wheres + " {}".format(condition)
             else:
-                if andor:
-                    sql_wheres = sql_wheres + " {} {} ? {} ".format(field, operator, andor)
-                else:
-                    sql_wheres = sql_wheres + " {} {} ? ".format(field, operator)
+                sql_wheres = sql_wheres + " {} {}".format(condition, andor)
 
-    # all aggregated values where
-    if sql_aggregates and sql_wheres:
-        if result_orderby_field:
-            result = "SELECT {} FROM {} WHERE {} ORDER BY {} {}}".format(sql_aggregates, name, sql_wheres,
-                                                                         result_orderby_field, result_order_direction)
-        else:
-            result = "SELECT {} FROM {} WHERE {};".format(sql_aggregates, name, sql_wheres)
-    # all aggregated values
-    elif sql_aggregates and not sql_wheres:
-        if result_orderby_field:
-            result = "SELECT {} FROM {} ORDER BY {} {}".format(sql_aggregates, name, result_orderby_field,
-                                                               result_order_direction)
-        else:
-            result = "SELECT {} FROM {};".format(sql_aggregates, name)
-    # all everything where
-    elif sql_wheres and not sql_aggregates:
-        if result_orderby_field:
-            result = "SELECT {} FROM {} WHERE {} ORDER BY {} {}".format(sql_filters, name, sql_wheres,
-                                                                        result_orderby_field, result_order_direction)
-        else:
-            result = "SELECT {} FROM {} WHERE {};".format(sql_filters, name, sql_wheres)
-    # all everything
-    else:
-        if result_orderby_field:
-            result = "SELECT {} FROM {} ORDER BY {} {}".format(sql_filters, name, result_orderby_field,
-                                                               result_order_direction)
-        else:
-            result = "SELECT {} FROM {};".format(sql_filters, name)
-    return result.replace("  ", " ")
+    result = "SELECT {} FROM {}".format(sql_columns, name)
+    if sql_wheres:
+        result = "{} WHERE{}".format(result, sql_wheres)
+    sql_orderby = build_orderby(orderby)
+    if sql_orderby:
+        result = "{} ORDER BY {}".format(result, sql_orderby)
+    if limit is not None or offset:
+        # sqlite takes an offset only after a limit - a negative limit has no upper bound
+        result = "{} LIMIT {}".format(result, -1 if limit is None else int(limit))
+        if offset:
+            result = "{} OFFSET {}".format(result, int(offset))
+    return "{};".format(result)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+from models.builders.build_index_query import index_definition
+
+
+def unique_key(model):
+    """
+    Conflict target of a model
+    Args:
+        model:
+
+    Returns:
+        tuple with fields and where - the first unique index or the id
+    """
+    for index in model.get("indexes", ()):
+        fields, unique, where = index_definition(index)
+        if unique:
+            return fields, where
+    return (model["id"],), ""
+
+
+def build_upsert_query(model, fields=None):
+    """
+    Builds a query for supplied model
+    A row is inserted or - when its unique key exists - the existing row is updated
+    Args:
+        model:
+        fields: optional list of fields to update on conflict - default all but the key and the id
+
+    Returns:
+        valid sql statement for model
+    """
+    name = model["name"]
+    key, where = unique_key(model)
+    if not fields:
+        fields = [field for field in model["fields"] if field not in key and field != model["id"]]
+    target = "({})".format(", ".join(key))
+    if where:
+        # a partial unique index is only used when the target repeats its where clause
+        target = "{} WHERE {}".format(target, where)
+    return "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT {} DO UPDATE SET {};".format(
+        name, ", ".join(model["fields"]), ", ".join("?" * len(model["fields"])), target,
+        ", ".join("{0}=excluded.{0}".format(field) for field in fields))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Cache for sql statements built from model definitions"""
+
+import threading
+from collections import OrderedDict
+
+
+def freeze(value):
+    """
+    Turn the lists used for builder arguments into hashable tuples
+    Args:
+        value:
+
+    Returns:
+        hashable representation of value
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class StatementCache:
+    """
+    Least recently used cache of built sql statements
+    Returning the very same sql text for a query definition
+    lets the sqlite3 statement cache reuse the compiled statement
+    """
+
+    def __init__(self, size=256):
+        """
+        Initialize StatementCache
+        Args:
+            size: max number of statements kept
+        """
+        self._size = size
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self):
+        """
+        Cache counters
+        Returns:
+            dict with hits, misses and size
+        """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "size": len(self._statements)}
+
+    def get(self, key):
+        """
+        Lookup a statement
+        Args:
+            key:
+
+        Returns:
+            sql statement or None
+        """
+        with self._lock:
+            try:
+                sql = self._statements[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._statements.move_to_end(key)
+            self._hits += 1
+            return sql
+
+    def put(self, key, sql):
+        """
+        Store a statement
+        Args:
+            key:
+            sql:
+        """
+        with self._lock:
+            self._statements[key] = sql
+            self._statements.move_to_end(key)
+            while len(self._statements) > self._size:
+                self._statements.popitem(last=False)
+
+    def items(self):
+        """
+        Snapshot of the cached statements
+        Returns:
+            list of (key, sql)
+        """
+        with self._lock:
+            return list(self._statements.items())
+
+    def clear(self):
+        """
+        Drop all statements and reset counters
+        """
+        with self._lock:
+            self._statements.clear()
+            self._hits = 0
+            self._misses = 0
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Sqlite Connection Module"""
+
+import itertools
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from configuration import config
+
+__module__ = "connection"
+
+STORAGES = ("disk", "memory")
+BUSY_CODES = (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED
+
+
+def is_busy(error):
+    """
+    Check if an error is sqlite reporting a locked database
+    Args:
+        error: sqlite3.OperationalError
+    Returns:
+        bool
+    """
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        # extended codes keep the primary code in the low byte
+        return code & 0xff in BUSY_CODES
+    return "locked" in str(error) or "busy" in str(error)
+
+
+class Rollback(Exception):
+    """
+    Raise inside a transaction block to roll it back without propagating an error
+    """
+
+
+class ConnectionManager:
+    """
+    Long-lived sqlite connections reused across queries
+    All writes go through one writer connection - one thread at a time holds it
+    Reads use a reader connection per thread - in WAL mode a reader sees the last
+    committed data and is never blocked by a running write transaction
+    A worker thread releases its reader when done - a python thread which did not
+    is noticed when its thread object is collected and its reader is closed when
+    the next reader is opened
+    The connections run in autocommit mode - statements outside a transaction
+    block commit on their own and reads never issue a commit
+    A performance profile belongs to the thread which switched it - the writer
+    takes the profile of the thread holding it
+    """
+
+    def __init__(self):
+        """
+        Initialize ConnectionManager class
+        """
+        self._readers = {}
+        self._finished = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._owner = None
+        self._depth = 0
+        self._connections = []
+        self._applied = {}
+        self._stats = {"opened": 0, "reused": 0, "closed": 0, "released": 0, "retried": 0}
+        self._profile = config.DB_PROFILE
+        self._local = threading.local()
+        self._rollback_listeners = []
+        self._commit_listeners = []
+        self._storage = config.DB_STORAGE
+        self._memory = None
+        self._memory_uri = None
+        self._memory_names = itertools.count(1)
+
+    @property
+    def stats(self):
+        """
+        Connection counters
+        Returns:
+            dict with opened, reused, closed, released and retried counts
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def profile(self):
+        """
+        Name of the performance profile active on the calling thread
+        """
+        return getattr(self._local, "profile", self._profile)
+
+    @profile.setter
+    def profile(self, name):
+        """
+        Switch performance profile for the calling thread
+        Its reader picks up the new pragmas on the next use - the writer when the thread next writes
+        Other threads keep their profile
+        Args:
+            name: key in config.DB_PROFILES
+        """
+        if name not in config.DB_PROFILES:
+            raise KeyError("Unknown database profile: {}".format(name))
+        self._local.profile = name
+
+    @property
+    def storage(self):
+        """
+        Name of the active storage - disk or memory
+        """
+        return self._storage
+
+    @storage.setter
+    def storage(self, name):
+        """
+        Switch storage
+        Open connections are closed - switching to memory always starts with an empty database
+        Args:
+            name: disk or memory
+        """
+        if name not in STORAGES:
+            raise KeyError("Unknown database storage: {}".format(name))
+        self.close()
+        with self._lock:
+            if self._memory is not None:
+                self._memory.close()
+                self._memory = None
+            self._storage = name
+
+    def reader(self):
+        """
+        Connection for reading on the calling thread
+        Inside a transaction block the writer is returned so the block reads its own changes
+        An in-memory database has no WAL - its readers lock the tables they read and
+        wait for a running write transaction instead of seeing its changes
+        Returns:
+            sqlite3 connection
+        """
+        if self.in_transaction():
+            return self.writer()
+        ident = threading.get_ident()
+        with self._lock:
+            db = self._readers.get(ident)
+        if db is None:
+            self.__sweep()
+            db = self.__open()
+            with self._lock:
+                self._readers[ident] = db
+            # the finalizer may run on any thread at any time - it only queues the reader
+            weakref.finalize(threading.current_thread(), self._finished.append, (ident, db))
+        else:
+            self.__count("reused")
+        self.__prepare(db)
+        return db
+
+    def release(self):
+        """
+        Close the reader connection of the calling thread
+        Call when a worker thread is done - the next read opens a new one
+        """
+        with self._lock:
+            db = self._readers.pop(threading.get_ident(), None)
+        if db is not None:
+            self.__close(db, "released")
+
+    def __sweep(self):
+        """
+        Close readers left by finished threads which did not release them
+        Only threads registered when their reader was opened are swept - a thread
+        started outside the threading module is never taken for finished
+        """
+        stale = []
+        with self._lock:
+            # take what is queued - the finalizers keep appending to the same list
+            finished = self._finished[:]
+            del self._finished[:len(finished)]
+            for ident, db in finished:
+                # the ident may belong to a new thread by now
+                # a released reader is closed already
+                if self._readers.get(ident) is db:
+                    del self._readers[ident]
+                    stale.append(db)
+        for db in stale:
+            self.__close(db, "released")
+
+    def __close(self, db, counter):
+        """
+        Close a connection and forget it
+        """
+        with self._lock:
+            if db in self._connections:
+                self._connections.remove(db)
+            self._applied.pop(db, None)
+        try:
+            db.close()
+            self.__count(counter)
+        except sqlite3.ProgrammingError:
+            pass
+
+    def retry(self, call):
+        """
+        Run call and retry with backoff while the database is busy
+        Inside a transaction block the error is raised at once - the block has to be rerun as a whole
+        Args:
+            call: callable running the statement
+        Returns:
+            the result of call
+        """
+        delay = config.DB_BUSY_BACKOFF
+        for attempt in range(config.DB_BUSY_RETRIES + 1):
+            try:
+                return call()
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt == config.DB_BUSY_RETRIES or self.in_transaction():
+                    raise
+            self.__count("retried")
+            time.sleep(delay)
+            delay *= 2
+
+    def writer(self):
+        """
+        The writer connection
+        Hold the write lock - acquire(write=True) or transaction() - while writing on it
+        The profile of the holding thread is applied when the lock is taken
+        Returns:
+            sqlite3 connection
+        """
+        with self._lock:
+            db = self._writer
+        if db is None:
+            with self._write_lock:
+                if self._writer is None:
+                    self._writer = self.__open()
+                    self.__prepare(self._writer, self._profile)
+                db = self._writer
+        else:
+            self.__count("reused")
+        return db
+
+    @contextmanager
+    def acquire(self, write=False):
+        """
+        Connection for a single statement
+        Args:
+            write: the statement changes the database - waits for the writer
+        """
+        if not write:
+            yield self.reader()
+            return
+        with self._write_lock:
+            db = self.writer()
+            self.__prepare(db)
+            yield db
+
+    def connect(self):
+        """
+        Connection to the active storage outside the pool
+        Used for work which must not share a pooled connection - e.g. backup
+        The caller closes it
+        Returns:
+            sqlite3 connection
+        """
+        return self.__connect()
+
+    def __open(self):
+        """
+        Open a pooled connection to the active storage
+        Returns:
+            sqlite3 connection
+        """
+        db = self.__connect()
+        with self._lock:
+            self._connections.append(db)
+            self._stats["opened"] += 1
+        return db
+
+    def __connect(self):
+        """
+        Open a connection to the active storage
+        In memory mode every connection attaches to the same shared cache database
+        which lives as long as the manager holds its first connection
+        Returns:
+            sqlite3 connection
+        """
+        if self._storage == "memory":
+            with self._lock:
+                if self._memory is None:
+                    self._memory_uri = "file:eordre_{}?mode=memory&cache=shared".format(next(self._memory_names))
+                    self._memory = sqlite3.connect(self._memory_uri, uri=True, check_same_thread=False)
+            db = sqlite3.connect(self._memory_uri, uri=True, check_same_thread=False,
+                                 timeout=config.DB_BUSY_TIMEOUT / 1000.0,
+                                 cached_statements=config.DB_STATEMENT_CACHE,
+                                 isolation_level=None)
+            # shared cache connections could read rows of an open transaction - a reader waits for it
+            db.execute("PRAGMA read_uncommitted=0;")
+        else:
+            db = sqlite3.connect(config.DBPATH, check_same_thread=False,
+                                 timeout=config.DB_BUSY_TIMEOUT / 1000.0,
+                                 cached_statements=config.DB_STATEMENT_CACHE,
+                                 isolation_level=None)
+        return db
+
+    def __count(self, counter):
+        """
+        Increment a counter
+        """
+        with self._lock:
+            self._stats[counter] += 1
+
+    def __prepare(self, db, profile=None):
+        """
+        Apply a profile if the connection has another one
+        Pragmas are not changed inside a transaction
+        Args:
+            db:
+            profile: defaults to the profile of the calling thread
+        """
+        if profile is None:
+            profile = self.profile
+        if self._applied.get(db) != profile and not db.in_transaction:
+            for pragma, value in config.DB_PROFILES[profile]:
+                # auto_vacuum belongs to the file and waits for the write lock - it is set by the writer
+                if pragma == "auto_vacuum" and db is not self._writer:
+                    continue
+                db.execute("PRAGMA {}={};".format(pragma, value))
+            self._applied[db] = profile
+
+    def pragmas(self):
+        """
+        Effective pragma values on the calling thread's reader connection
+        Returns:
+            dict with pragma name and value
+        """
+        db = self.reader()
+        result = {}
+        for pragma in config.DB_PRAGMAS:
+            # some pragmas return nothing for an in-memory database
+            row = db.execute("PRAGMA {};".format(pragma)).fetchone()
+            result[pragma] = row[0] if row else None
+        return result
+
+    def in_transaction(self):
+        """
+        Check if the calling thread has an open transaction block
+        Returns:
+            bool
+        """
+        return self._owner == threading.get_ident() and self._depth > 0
+
+    def on_rollback(self, callback):
+        """
+        Register a callable run after a transaction block was rolled back
+        Args:
+            callback: called without arguments
+        """
+        self._rollback_listeners.append(callback)
+
+    def on_commit(self, callback):
+        """
+        Register a callable run after the outermost transaction block was committed
+        Args:
+            callback: called without arguments
+        """
+        self._commit_listeners.append(callback)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group statements on the writer connection in one transaction
+        Other threads wait for the writer until the block ends
+        Blocks can be nested - inner blocks use savepoints
+        Raising Rollback inside a block discards its statements
+        """
+        with self._write_lock:
+            db = self.writer()
+            self.__prepare(db)
+            depth = self._depth
+            if depth:
+                savepoint = "sp_{}".format(depth)
+                db.execute("SAVEPOINT {};".format(savepoint))
+            else:
+                # take the write lock up front - a busy database fails here and not halfway
+                self.retry(lambda: db.execute("BEGIN IMMEDIATE;"))
+                self._owner = threading.get_ident()
+            self._depth = depth + 1
+            try:
+                yield db
+            except BaseException as e:
+                self.__leave(depth)
+                # sqlite may already have rolled back on some errors
+                if db.in_transaction:
+                    if depth:
+                        db.execute("ROLLBACK TO {};".format(savepoint))
+                        db.execute("RELEASE {};".format(savepoint))
+                    else:
+                        db.execute("ROLLBACK;")
+                for callback in self._rollback_listeners:
+                    callback()
+                if not isinstance(e, Rollback):
+                    raise
+            else:
+                self.__leave(depth)
+                if depth:
+                    db.execute("RELEASE {};".format(savepoint))
+                else:
+                    db.execute("COMMIT;")
+                    for callback in self._commit_listeners:
+                        callback()
+
+    def __leave(self, depth):
+        """
+        Step out of a transaction block
+        """
+        self._depth = depth
+        if not depth:
+            self._owner = None
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Read a consistent snapshot on the calling thread's reader
+        Every read in the block sees the database as it was at the first read
+        Changes committed by other threads meanwhile are not visible
+        An in-memory database keeps writers to the tables read out until the block ends
+        """
+        db = self.reader()
+        if db.in_transaction:
+            # already inside a snapshot or a transaction block
+            yield db
+            return
+        db.execute("BEGIN;")
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.execute("COMMIT;")
+
+    def close(self):
+        """
+        Close every connection opened by the manager
+        A shared in-memory database is kept - switch storage to discard it
+        """
+        with self._write_lock:
+            with self._lock:
+                for db in self._connections:
+                    try:
+                        db.close()
+                        self._stats["closed"] += 1
+                    except sqlite3.ProgrammingError:
+                        pass
+                self._connections = []
+                self._applied = {}
+                self._readers = {}
+                self._writer = None
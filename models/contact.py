@@ -6,31 +6,32 @@
 
 """Contact module"""
 
-from models.query import Query
+import json
+
+from models.connection import Rollback
+from models.model import Model
 
 __module = "contact"
 
 
-class Contact:
+class Contact(Model):
     """
     Contact class
     """
+    model = {
+        "name": "contacts",
+        "id": "contact_id",
+        "fields": ("contact_id", "customer_id", "name", "department", "email", "phone", "infotext"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "TEXT", "TEXT", "TEXT", "TEXT", "TEXT"),
+        "indexes": (("customer_id",),)
+    }
 
     def __init__(self):
         """Initialize contact class"""
-        self.model = {
-            "name": "contacts",
-            "id": "contact_id",
-            "fields": ("contact_id", "customer_id", "name", "department", "email", "phone", "infotext"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "TEXT", "TEXT", "TEXT", "TEXT", "TEXT")
-        }
         self._contact = {}
         self._contacts = []
         self._csv_record_length = 8
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def contact(self):
@@ -90,13 +91,8 @@ class Contact:
         Returns:
             bool
         """
-        filters = [("contact_id", "=")]
-        values = (contact_id,)
-        sql = self.q.build("delete", self.model, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return True
-        return False
+        success, data = self.q.execute(self._sql["delete_id"], values=(contact_id,))
+        return success
 
     def find(self, contact_id):
         """
@@ -106,40 +102,55 @@ class Contact:
         Returns:
             bool
         """
-        values = (contact_id,)
-        sql = self.q.build("select", self.model)
-        success, data = self.q.execute(sql, values=values)
-        if success:
-            try:
-                self._contact = dict(zip(self.model["fields"], data[0]))
-            except IndexError:
-                pass
-        if success and data:
-            return True
-        return False
+        contact = self.select_id(contact_id)
+        if contact is None:
+            return False
+        self._contact = contact
+        return True
+
+    def sync(self, rows):
+        """
+        Replace the contacts with the rows of a csv import
+        Contacts are inserted or updated by contact_id - contacts
+        missing from the rows are deleted - all in one transaction
+        Args:
+            rows: list of value tuples with the contact_id
+        Returns:
+            number of rows inserted or updated
+        """
+        rows = list(rows)
+        count = False
+        with self.q.transaction():
+            count = self.upsert_many(rows)
+            if count is False:
+                raise Rollback
+            sql = "DELETE FROM {} WHERE contact_id NOT IN (SELECT value FROM json_each(?));".format(
+                self.model["name"])
+            success, data = self.q.execute(sql, values=(json.dumps([int(row[0]) for row in rows]),))
+            if not success:
+                count = False
+                raise Rollback
+        self.clear()
+        return count
 
     def translate_row_insert(self, row):
         """
-        Translate a csv row
+        Translate a csv row and insert it
         Args:
             row:
         """
-        new_row = (row[0], row[1], row[2].strip(), row[3].strip(), row[4].strip(), row[5].strip(), row[7].strip())
-        self.insert(new_row)
+        self.insert(self.translate_row(row))
 
-    def insert(self, values):
+    def translate_row(self, row):
         """
-        Insert items
+        Translate a csv row
         Args:
-            values: contact data to insert in contact table
+            row:
         Returns:
-            the new rowid
+            tuple with values for insert
         """
-        sql = self.q.build("insert", self.model)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
-        return False
+        new_row = (row[0], row[1], row[2].strip(), row[3].strip(), row[4].strip(), row[5].strip(), row[7].strip())
+        return new_row
 
     def load_for_customer(self, customer_id):
         """
@@ -155,7 +166,7 @@ class Contact:
         success, data = self.q.execute(sql, values=values)
         if success:
             try:
-                self._contacts = [dict(zip(self.model["fields"], row)) for row in data]
+                self._contacts = [self._row(*row) for row in data]
                 self._contact = self._contacts[0]
                 return True
             except IndexError:
@@ -163,27 +174,10 @@ class Contact:
                 self._contacts = []
         return False
 
-    def recreate_table(self):
-        """
-        Drop and create table
-        """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
-
     def update(self):
         """
         Update item
         Returns:
             bool
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._contact.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return True
-        return False
+        return self.update_row(self._contact)
@@ -6,42 +6,47 @@
 
 """Customer module"""
 
-from models.query import Query
+import sqlite3
+
+from models.model import Model
 from util import utils
 
 __module__ = "customer"
 
 
-class Customer:
+class Customer(Model):
     """
     Customer class
     """
+    model = {
+        "name": "customers",
+        "id": "customer_id",
+        "fields": ("customer_id", "account", "company",
+                   "address1", "address2", "zipcode", "city", "country",
+                   "salesrep", "phone1", "vat", "email", "deleted", "modified",
+                   "created", "infotext", "att", "phone2", "factor",
+                   "body", "plate", "paint", "industry"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT NOT NULL", "TEXT NOT NULL",
+                  "TEXT", "TEXT", "TEXT", "TEXT", "TEXT",
+                  "TEXT NOT NULL", "TEXT", "TEXT", "TEXT", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
+                  "TEXT", "TEXT", "TEXT", "TEXT", "REAL",
+                  "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0"),
+        "indexes": (("account",), ("phone1", "company"),
+                    # accounts come from the server - new customers share the placeholder NY
+                    {"fields": ("account",), "unique": True, "where": "account <> 'NY'"})
+    }
+    # fields the server owns - updated when a downloaded account exists
+    http_fields = ("company", "address1", "address2", "zipcode", "city", "phone1",
+                   "vat", "email", "modified", "att", "phone2")
 
     def __init__(self):
         """
         Initialize Customer class
         """
-        self.model = {
-            "name": "customers",
-            "id": "customer_id",
-            "fields": ("customer_id", "account", "company",
-                       "address1", "address2", "zipcode", "city", "country",
-                       "salesrep", "phone1", "vat", "email", "deleted", "modified",
-                       "created", "infotext", "att", "phone2", "factor",
-                       "body", "plate", "paint", "industry"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT NOT NULL", "TEXT NOT NULL",
-                      "TEXT", "TEXT", "TEXT", "TEXT", "TEXT",
-                      "TEXT NOT NULL", "TEXT", "TEXT", "TEXT", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
-                      "TEXT", "TEXT", "TEXT", "TEXT", "REAL",
-                      "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0")
-        }
         self._customers = []
         self._customer = {}
         self._csv_record_length = 20
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def customer(self):
@@ -111,14 +116,7 @@ class Customer:
         Returns:
             bool
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._customer.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return True
-        return False
+        return self.update_row(self._customer)
 
     def lookup_by_id(self, customer_id):
         """
@@ -128,17 +126,12 @@ class Customer:
         Returns:
             bool
         """
-        filters = [("customer_id", "=")]
-        values = (customer_id,)
-        sql = self.q.build("select", self.model, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success:
-            try:
-                self._customer = dict(zip(self.model["fields"], data[0]))
-                return True
-            except IndexError:
-                self._customer = {}
-        return False
+        customer = self.select_id(customer_id)
+        if customer is None:
+            self._customer = {}
+            return False
+        self._customer = customer
+        return True
 
     def lookup(self, phone, company, account=None):
         """
@@ -166,7 +159,7 @@ class Customer:
             success, data = self.q.execute(sql, values=values)
         if success:
             try:
-                self._customer = dict(zip(self.model["fields"], data[0]))
+                self._customer = self._row(*data[0])
                 return True
             except IndexError:
                 self._customer = {}
@@ -174,21 +167,28 @@ class Customer:
 
     def recreate_table(self):
         """
-        Drop and create table
+        Empty the table - the schema and indexes are kept
         """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
+        super().recreate_table()
         self.clear_()
 
     def translate_row_insert(self, row):
+        """
+        Translate a csv row and insert it
+        Args:
+            row:
+        """
+        self.insert(self.translate_row(row))
+
+    def translate_row(self, row):
         """
         Translate a csv row
         Args:
             row:
                 The expected file format contains data in the following sequence
                 id acc comp add1 add2 zipcode city country s_rep phon1 vat email del mod cre info
+        Returns:
+            tuple with values for insert
         """
         # translate field from bool text to integer
         field_15 = utils.bool2int(utils.arg2bool(row[15]))
@@ -198,14 +198,49 @@ class Customer:
                    row[6].strip(), row[7].strip(), row[8].strip(), row[9].strip(), row[10].strip(),
                    row[12].strip(), field_15, row[16], row[17],
                    row[19].strip(), "", "", 0.0, 0, 0, 0, 0)
-        self.insert(new_row)
+        return new_row
 
     def import_http(self, values):
         """
-        Import customers from http
+        Import a customer from http
+        The customer is inserted or - when the account exists - updated in one statement
         Args:
             values: List with values from http request
             expected incoming fields: acc comp add1 add2 zipcity country s_rep phone1 vat email att phon2
+        Returns:
+            bool
+        """
+        return self.import_http_many([values]) == 1
+
+    def import_http_many(self, rows):
+        """
+        Import customers from http in one transaction
+        Args:
+            rows: iterable of value lists from http request - see import_http
+        Returns:
+            number of customers inserted or updated
+        """
+        rows = list(rows)
+        sql = self.q.build("upsert", self.model, update=self.http_fields)
+        success, data = self.q.execute_many(sql, map(self.translate_http, rows))
+        if success:
+            return data[0]
+        # no unique account index - existing rows share an account
+        count = 0
+        with self.q.transaction():
+            for values in rows:
+                self.__merge_http(values)
+                count += 1
+        return count
+
+    @staticmethod
+    def translate_http(values):
+        """
+        Translate a http row
+        Args:
+            values: List with values from http request - see import_http
+        Returns:
+            tuple with values for insert
         """
         # import file has 'zip  city'
         # app use 'zip' 'city' in different columns
@@ -218,65 +253,56 @@ class Customer:
         zipcity = zipcity.split("|")
         zipcode = zipcity[0].strip()
         city = zipcity[1].strip()
-        phone = values[7].strip()
-        account = values[0].strip()
-        company = values[1].strip()
+        return (None, values[0].strip(), values[1].strip(), values[2].strip(), values[3].strip(), zipcode, city,
+                values[5].strip(), values[6].strip(), values[7].strip(), values[8].strip(),
+                values[9].strip(), 0, 0, 0, "", values[10].strip(), values[11].strip(), 0.0, 0, 0, 0, 0)
+
+    def __merge_http(self, values):
+        """
+        Look up a http row and update or insert it
+        Args:
+            values: List with values from http request - see import_http
+        """
+        row = self.translate_http(values)
         # lookup existing current
         if self.lookup(values[7], values[1], values[0]):
             # sanitize and assign values
             if self._customer["account"] == 'NY':
-                self._customer["account"] = account
-            if self._customer["modified"] == 1:
-                self._customer["modified"] = 0
-            self._customer["company"] = company
-            self._customer["address1"] = values[2].strip()
-            self._customer["address2"] = values[3].strip()
-            self._customer["zipcode"] = zipcode  # zipcity[4]
-            self._customer["city"] = city  # zipcity[4]
+                self._customer["account"] = row[1]
+            for field in self.http_fields:
+                self._customer[field] = row[self._positions[field]]
             # skip over country[5] and salesrep[6]
-            self._customer["phone1"] = phone
-            self._customer["vat"] = values[8].strip()
-            self._customer["email"] = values[9].strip()
-            self._customer["att"] = values[10].strip()
-            self._customer["phone2"] = values[11].strip()
             self.update_()  # call update function
         else:
-            row_values = (None, account, company, values[2], values[3].strip(), zipcode, city,
-                          values[5].strip(), values[6].strip(), phone, values[8].strip(),
-                          values[9].strip(), 0, 0, 0, "", values[10].strip(), values[11].strip(), 0.0, 0, 0, 0, 0)
-            self.insert(row_values)
+            self.insert(row)
 
-    def insert(self, values):
+    def load(self):
         """
-        Insert a new current
-        Args:
-            values:
+        Load customers
         Returns:
-            rowid
+            bool
         """
-        sql = self.q.build("insert", self.model)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
+        try:
+            self._customers = list(self.iter_customers())
+        except sqlite3.Error:
+            self._customers = []
+        try:
+            self._customer = self._customers[0]
+            return True
+        except IndexError:
+            self._customer = {}
+            self._customers = []
         return False
 
-    def load(self):
+    def iter_customers(self):
         """
-        Load customers
+        Stream customers without building the full list
         Returns:
-            bool
+            generator of customers
         """
-        sql = self.q.build("select", self.model)
-        success, data = self.q.execute(sql)
-        if success:
-            try:
-                self._customers = [dict(zip(self.model["fields"], row)) for row in data]
-                self._customer = self._customers[0]
-                return True
-            except IndexError:
-                self._customer = {}
-                self._customers = []
-        return False
+        row_type = self._row
+        for row in self.q.iter_rows(self._sql["select"]):
+            yield row_type(*row)
 
     # def lookup_by_id(self, customer_id):
     #     """
@@ -336,11 +362,4 @@ class Customer:
         Returns:
             bool
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._customer.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return True
-        return False
+        return self.update_row(self._customer)
@@ -6,34 +6,34 @@
 
 """Customer products module"""
 
-from models.query import Query
+from configuration import config
+from models.orderline import OrderLine
+from models.model import Model
 from models.visit import Visit
 
 __module__ = "customer_products"
 
 
-class CustomerProducts:
+class CustomerProducts(Model):
     """
     CustomerProduct class
     """
+    model = {
+        "name": "customerproducts",
+        "id": "cp_id",
+        "fields": ("cp_id", "customer_id", "item", "sku", "pcs"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "TEXT NOT NULL",
+                  "TEXT NOT NULL", "INTEGER DEFAULT 0"),
+        "indexes": (("customer_id",),)
+    }
 
     def __init__(self):
         """
         Initialize CustomerProduct class
         """
-        self.model = {
-            "name": "customerproducts",
-            "id": "cp_id",
-            "fields": ("cp_id", "customer_id", "item", "sku", "pcs"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "TEXT NOT NULL",
-                      "TEXT NOT NULL", "INTEGER DEFAULT 0")
-        }
         self._products = []
         self._product = {}
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def list_(self):
@@ -70,20 +70,6 @@ class CustomerProducts:
         self.insert((None, customer_id, item, sku, pcs))
         self.__load(customer_id)
 
-    def insert(self, values):
-        """
-        Insert a new current
-        Args:
-            values:
-        Returns:
-            rowid
-        """
-        sql = self.q.build("insert", self.model)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
-        return False
-
     def __load(self, customer_id):
         """
         Load products
@@ -98,7 +84,7 @@ class CustomerProducts:
         success, data = self.q.execute(sql, values=values)
         if success:
             try:
-                self._products = [dict(zip(self.model["fields"], row)) for row in data]
+                self._products = [self._row(*row) for row in data]
                 return True
             except IndexError:
                 self._products = []
@@ -107,44 +93,47 @@ class CustomerProducts:
     def refresh(self, customer_id):
         """
         Refresh customers product list
+        Sums the pieces ordered per sku on all visits for the customer
         Args:
             customer_id
         Returns:
             bool
         """
-        visit = Visit()
-        selection = ("customer_id",)
+        selection = ("visit_id",)
         filters = [("customer_id", "=")]
         values = (customer_id,)
-        sql = self.q.build("select", visit.model, selection=selection, filters=filters)
+        sql = self.q.build("select", Visit.model, selection=selection, filters=filters)
         success, data = self.q.execute(sql, values=values)
-        if success:
-            try:
-                v_ids = data[0]
-                sql = "SELECT lines.sku, sum(pcs) AS pcs, product.item " \
-                      "FROM lines " \
-                      "INNER JOIN product ON product.sku = lines.sku " \
-                      "WHERE cust_id IN ? GROUP BY lines.sku"
-                success, data = self.q.execute(sql, v_ids)
-                if success:
-                    try:
-                        self._products = [dict(zip(self.model["fields"], row)) for row in data]
-                    except IndexError:
-                        pass
-                return True
-            except IndexError:
-                self._products = []
-        return False
-
-    def recreate_table(self):
-        """
-        Drop and create table
-        """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
+        if not success:
+            return False
+        visit_ids = [row[0] for row in data]
+        # lines of archived visits are in the archive of the visit
+        archived_ids = [row[0] for row in self.q.archives.select(Visit.model, selection=selection,
+                                                                 filters=filters, values=values)]
+        selection = ("item", "sku", "pcs")
+        totals = {}
+        # one statement per chunk of visits instead of one per visit
+        chunks = [(idx, False) for idx in range(0, len(visit_ids), config.DB_IN_LIST_MAX)]
+        chunks += [(idx, True) for idx in range(0, len(archived_ids), config.DB_IN_LIST_MAX)]
+        for idx, archived in chunks:
+            chunk = (archived_ids if archived else visit_ids)[idx:idx + config.DB_IN_LIST_MAX]
+            filters = [("visit_id", ("in", len(chunk))), ("sku", "<>")]
+            values = tuple(chunk) + ("",)
+            if archived:
+                data = self.q.archives.select(OrderLine.model, selection=selection, filters=filters, values=values)
+            else:
+                sql = self.q.build("select", OrderLine.model, selection=selection, filters=filters)
+                success, data = self.q.execute(sql, values=values)
+                if not success:
+                    return False
+            for item, sku, pcs in data:
+                if sku in totals:
+                    totals[sku][1] += pcs or 0
+                else:
+                    totals[sku] = [item, pcs or 0]
+        self._products = [self._row(None, customer_id, item, sku, pcs)
+                          for sku, (item, pcs) in sorted(totals.items())]
+        return True
 
     def update(self):
         """
@@ -152,11 +141,4 @@ class CustomerProducts:
         Returns:
             bool
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._product.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return True
-        return False
+        return self.update_row(self._product)
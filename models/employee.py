@@ -8,33 +8,31 @@
 Employee Module
 """
 
-from models.query import Query
+from models.model import Model
 from models.settings import Settings
 from util import httpFn, rules
 
 __module__ = "employee"
 
 
-class Employee:
+class Employee(Model):
     """
     Employee class
     """
+    model = {
+        "name": "employees",
+        "id": "employee_id",
+        "fields": ("employee_id", "salesrep", "fullname", "email", "country", "sas"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT", "TEXT", "TEXT", "TEXT", "INTEGER DEFAULT 0"),
+        "indexes": (("email",),)
+    }
 
     def __init__(self):
         """
         Initialize Employee class
         """
-        self.model = {
-            "name": "employees",
-            "id": "employee_id",
-            "fields": ("employee_id", "salesrep", "fullname", "email", "country", "sas"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT", "TEXT", "TEXT", "TEXT", "INTEGER DEFAULT 0")
-        }
         self._employee = {}
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
         self.s = Settings()
         if rules.check_settings(self.s.settings):
             self.load(self.s.settings["usermail"])
@@ -46,15 +44,6 @@ class Employee:
         """
         return self._employee
 
-    def insert(self, values):
-        """
-        Insert employee in database
-        Args:
-            values:
-        """
-        sql = self.q.build("insert", self.model)
-        self.q.execute(sql, values=values)
-
     def load(self, email):
         """
         Load the employee
@@ -67,7 +56,7 @@ class Employee:
         # second check is in exception handling
         try:
             _ = data[0]
-            self._employee = dict(zip(self.model["fields"], data[0]))
+            self._employee = self._row(*data[0])
         except IndexError:
             if httpFn.inet_conn_check():
                 # load from http
@@ -76,7 +65,7 @@ class Employee:
                 try:
                     # second check after load_from_http
                     _ = data[0]
-                    self._employee = dict(zip(self.model["fields"], data[0]))
+                    self._employee = self._row(*data[0])
                 except IndexError:
                     self._employee = {}
 
@@ -95,10 +84,4 @@ class Employee:
         """
         Update employee in database
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._employee.values())
-
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-
-        self.q.execute(sql, values=values)
+        self.update_row(self._employee)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Query plan audit module
+
+Runs EXPLAIN QUERY PLAN for the statements built by the models
+and flags full table scans and temporary sort trees
+
+    python -m models.explain [database]
+"""
+
+import sqlite3
+import sys
+
+from configuration import config
+from models.connection import Rollback
+from models.query import Query
+
+__module__ = "explain"
+
+AUDITED = ("SELECT", "UPDATE", "DELETE")
+
+
+class PlanAuditor:
+    """
+    Query plan auditor
+    """
+
+    def __init__(self, db=None):
+        """
+        Initialize PlanAuditor class
+        Args:
+            db: optional sqlite3 connection - default is the query connection
+        """
+        self._db = db
+
+    @property
+    def db(self):
+        """
+        Connection used for explaining
+        """
+        if self._db is None:
+            return Query.connections.reader()
+        return self._db
+
+    def explain(self, sql):
+        """
+        Query plan for a statement
+        Parameters are bound to a plain text value so GLOB and LIKE prefixes can use an index
+        Args:
+            sql: statement
+        Returns:
+            list of plan detail lines
+        """
+        values = ("0",) * sql.count("?")
+        rows = self.db.execute("EXPLAIN QUERY PLAN {}".format(sql), values).fetchall()
+        return [row[3] for row in rows]
+
+    @staticmethod
+    def check(sql, plan):
+        """
+        Findings for a query plan
+        Args:
+            sql: statement
+            plan: plan detail lines
+        Returns:
+            list of (level, detail)
+            a scan is a warning when the statement is filtered - reading a whole table is expected otherwise
+        """
+        filtered = " WHERE " in sql.upper()
+        findings = []
+        for detail in plan:
+            if detail.startswith("SCAN"):
+                findings.append(("warning" if filtered else "info", detail))
+            elif "TEMP B-TREE" in detail:
+                findings.append(("warning", detail))
+        return findings
+
+    def audit(self, statements=None):
+        """
+        Explain statements and group the result per model
+        Args:
+            statements: optional iterable of (key, sql) - default is the Query statement cache
+        Returns:
+            dict of model name with list of dicts with sql, plan and findings
+        """
+        if statements is None:
+            statements = Query.statements.items()
+        result = {}
+        seen = set()
+        for key, sql in statements:
+            query_type, model = key[0], key[1]
+            if query_type not in AUDITED or sql in seen:
+                continue
+            seen.add(sql)
+            try:
+                plan = self.explain(sql)
+                findings = self.check(sql, plan)
+            except sqlite3.DatabaseError as e:
+                plan = []
+                findings = [("error", str(e))]
+            result.setdefault(model, []).append({"sql": sql, "plan": plan, "findings": findings})
+        return result
+
+    @staticmethod
+    def report(result):
+        """
+        Audit result as text
+        Args:
+            result: audit result
+        Returns:
+            string
+        """
+        lines = []
+        for model in sorted(result):
+            entries = result[model]
+            flagged = sum(1 for entry in entries if entry["findings"])
+            lines.append("{} - {} statements, {} flagged".format(model, len(entries), flagged))
+            for entry in entries:
+                if not entry["findings"]:
+                    continue
+                lines.append("  {}".format(entry["sql"]))
+                for level, detail in entry["findings"]:
+                    lines.append("    {:<8} {}".format(level, detail))
+        return "\n".join(lines)
+
+
+def workload():
+    """
+    Run the read paths of the models so their statements are built
+    Rows written on the way are rolled back
+    """
+    # imported here - the models import Query on their own
+    from models.contact import Contact
+    from models.customer import Customer
+    from models.customerproducts import CustomerProducts
+    from models.orderline import OrderLine
+    from models.product import Product
+    from models.report import Report
+    from models.reportcalculator import ReportCalculator
+    from models.settings import Settings
+    from models.visit import Visit
+
+    workdate = "2000-01-01"
+    # the models create missing tables - outside the discarded transaction
+    customer = Customer()
+    contact = Contact()
+    visit = Visit()
+    lines = OrderLine()
+    products = CustomerProducts()
+    product = Product()
+    calculator = ReportCalculator()
+    report = Report()
+    settings = Settings()
+    with Query.transaction():
+        customer.lookup("", "")
+        customer.lookup("", "", account="NY")
+        customer.lookup_by_id(0)
+        customer.load()
+        contact.load_for_customer(0)
+        visit.list_by_customer(0)
+        visit.list_by_date(workdate)
+        visit.list_by_report_id(0)
+        visit.load_visit(0)
+        lines.load_visit(0)
+        lines.find(0)
+        products.list_ = 0
+        products.refresh(0)
+        _ = product.products
+        calculator.get_by_id(0)
+        calculator.get_by_date_employee(workdate, 0)
+        report.load(year="2000", month="01")
+        report.create({"employee_id": 0, "salesrep": ""}, workdate)
+        settings.get()
+        raise Rollback
+
+
+def main(args):
+    """
+    Audit the statements of the models against a database
+    Args:
+        args: optional database path
+    """
+    if args:
+        config.DBPATH = args[0]
+    workload()
+    print(PlanAuditor().report(PlanAuditor().audit()))
+    Query.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Database maintenance module"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from configuration import config
+from models.orderline import OrderLine
+from models.query import Query
+from models.visit import Visit
+
+__module__ = "maintenance"
+
+LOG_TABLE = "maintenance_log"
+LOG_MODEL = {
+    "name": LOG_TABLE,
+    "id": "task",
+    "fields": ("task", "ran", "seconds", "size_before", "size_after", "result"),
+    "types": ("TEXT PRIMARY KEY NOT NULL", "TEXT NOT NULL", "REAL DEFAULT 0",
+              "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "TEXT")
+}
+TASKS = ("archive", "optimize", "vacuum", "integrity")
+
+
+class Maintenance:
+    """
+    Keeps the planner statistics current and returns free pages to the file system
+    The work is split in short steps - each step holds the writer briefly and
+    the run can be stopped between any two steps
+    Tasks:
+        archive - move visits and order lines of closed years to their yearly archive
+        optimize - PRAGMA optimize or ANALYZE table by table when no statistics exist
+        vacuum - incremental vacuum in chunks of config.DB_VACUUM_PAGES
+        integrity - PRAGMA integrity_check on a reader connection
+    """
+
+    def __init__(self):
+        """
+        Initialize Maintenance class
+        """
+        self._stop = threading.Event()
+        self._results = {}
+
+    @property
+    def results(self):
+        """
+        Outcome of the tasks run by this instance
+        Returns:
+            dict of task with result text
+        """
+        return dict(self._results)
+
+    def stop(self):
+        """
+        Stop after the running step - a stopped instance stays stopped
+        """
+        self._stop.set()
+
+    @staticmethod
+    def size():
+        """
+        Database size
+        Returns:
+            tuple with total and free bytes
+        """
+        db = Query.connections.reader()
+        page_size = db.execute("PRAGMA page_size;").fetchone()[0]
+        pages = db.execute("PRAGMA page_count;").fetchone()[0]
+        free = db.execute("PRAGMA freelist_count;").fetchone()[0]
+        return pages * page_size, free * page_size
+
+    @staticmethod
+    def last_runs():
+        """
+        When the tasks ran last
+        Returns:
+            dict of task with datetime
+        """
+        if not Query.schema.exists(Query.connections.reader(), LOG_TABLE):
+            return {}
+        rows = Query.connections.reader().execute("SELECT task, ran FROM {};".format(LOG_TABLE)).fetchall()
+        return {task: datetime.strptime(ran, "%Y-%m-%dT%H:%M:%S") for task, ran in rows}
+
+    def due(self, task, at_exit=False):
+        """
+        Check if a task has work to do
+        Args:
+            task: archive, optimize, vacuum or integrity
+            at_exit: the app is closing
+        Returns:
+            bool
+        """
+        if task == "vacuum":
+            total, free = self.size()
+            if not free:
+                return False
+            if self.__incremental():
+                return True
+            # only a full VACUUM switches an existing database to incremental vacuum
+            return at_exit and free >= total * config.DB_VACUUM_RATIO
+        if task in ("archive", "integrity") and at_exit:
+            return False
+        if task == "archive":
+            return bool(self.__closed_years())
+        intervals = {"optimize": timedelta(hours=config.DB_OPTIMIZE_HOURS),
+                     "integrity": timedelta(days=config.DB_INTEGRITY_DAYS)}
+        ran = self.last_runs().get(task)
+        return ran is None or datetime.today() - ran >= intervals[task]
+
+    def steps(self, at_exit=False):
+        """
+        Run the due tasks one step at a time
+        Args:
+            at_exit: the app is closing - the integrity check is left for the next idle run
+        Returns:
+            generator of status text after every step
+        """
+        for task in TASKS:
+            if self._stop.is_set():
+                return
+            if self.due(task, at_exit):
+                yield from self.__task(task, at_exit)
+
+    def run(self, at_exit=False):
+        """
+        Run the due tasks with a short pause between the steps
+        Args:
+            at_exit: see steps
+        Returns:
+            dict of task with result text
+        """
+        for _ in self.steps(at_exit):
+            time.sleep(config.DB_MAINTENANCE_PAUSE)
+        return self.results
+
+    def __task(self, task, at_exit):
+        """
+        Run a task and log its timing and the size change
+        """
+        log = Query.profiler.logger()
+        total, free = self.size()
+        started = time.perf_counter()
+        steps = {"archive": self.__archive, "optimize": self.__optimize, "vacuum": self.__vacuum, "integrity": self.__integrity}
+        result = yield from steps[task](at_exit)
+        elapsed = time.perf_counter() - started
+        after, free_after = self.size()
+        self._results[task] = result
+        if result != "stopped":
+            self.__record(task, elapsed, total, after, result)
+        log.info("maintenance %s %.2f s | size %d kB -> %d kB (%+d kB) | free %d kB -> %d kB | %s",
+                 task, elapsed, total // 1024, after // 1024, (after - total) // 1024,
+                 free // 1024, free_after // 1024, result)
+        if task == "integrity" and result != "ok":
+            log.warning("integrity check failed: %s", result)
+
+    def __archive(self, at_exit):
+        """
+        Move the closed years to their archives - one year per step
+        """
+        moved = 0
+        for year in self.__closed_years():
+            if self._stop.is_set():
+                break
+            moved += Query.archives.move(year, Visit.model, "visit_date", ((OrderLine.model, "visit_id"),))
+            # the rows left on the writer - cached results still hold them
+            Query.results.touch(Visit.model["name"], OrderLine.model["name"])
+            yield "archive {}".format(year)
+        return "archived {} visits".format(moved)
+
+    @staticmethod
+    def __closed_years():
+        """
+        Closed years with visits in the database
+        """
+        db = Query.connections.reader()
+        if not Query.schema.exists(db, Visit.model["name"]):
+            return []
+        rows = db.execute("SELECT DISTINCT substr(visit_date, 1, 4) FROM visits WHERE visit_date < ?;",
+                          ("{}-01-01".format(Query.archives.closed()),)).fetchall()
+        return sorted(int(year) for year, in rows if year.isdigit())
+
+    def __optimize(self, at_exit):
+        """
+        Refresh the planner statistics
+        A database which was never analyzed gets a full ANALYZE - one table per step
+        """
+        with Query.connections.acquire(write=True) as db:
+            db.execute("PRAGMA analysis_limit={};".format(config.DB_ANALYSIS_LIMIT))
+            tables = [name for name, in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';")]
+            analyzed = db.execute("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1';").fetchone()[0]
+        if analyzed:
+            with Query.connections.acquire(write=True) as db:
+                Query.connections.retry(lambda: db.execute("PRAGMA optimize;").fetchall())
+            yield "optimize"
+            return "optimized"
+        for table in tables:
+            if self._stop.is_set():
+                return "stopped"
+            with Query.connections.acquire(write=True) as db:
+                Query.connections.retry(lambda: db.execute("ANALYZE {};".format(table)))
+            yield "analyze {}".format(table)
+        return "analyzed {} tables".format(len(tables))
+
+    def __vacuum(self, at_exit):
+        """
+        Return free pages to the file system
+        """
+        if not self.__incremental():
+            # the database predates incremental vacuum - rebuild it once while closing
+            with Query.connections.acquire(write=True) as db:
+                db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+                Query.connections.retry(lambda: db.execute("VACUUM;"))
+            yield "vacuum"
+            return "rebuilt"
+        released = 0
+        while not self._stop.is_set():
+            with Query.connections.acquire(write=True) as db:
+                free = db.execute("PRAGMA freelist_count;").fetchone()[0]
+                if not free:
+                    break
+                # execute steps the pragma only once - one page - executescript runs it to the end
+                Query.connections.retry(lambda: db.executescript(
+                    "PRAGMA incremental_vacuum({});".format(config.DB_VACUUM_PAGES)))
+                left = db.execute("PRAGMA freelist_count;").fetchone()[0]
+            released += free - left
+            yield "vacuum {} pages left".format(left)
+        with Query.connections.acquire(write=True) as db:
+            # a passive checkpoint moves the truncation from the wal into the file without waiting
+            db.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchall()
+        return "released {} pages".format(released)
+
+    def __integrity(self, at_exit):
+        """
+        Check the database on the reader - writers are not blocked
+        """
+        rows = Query.connections.reader().execute("PRAGMA integrity_check;").fetchall()
+        yield "integrity"
+        return "; ".join(row[0] for row in rows[:10])
+
+    @staticmethod
+    def __incremental():
+        """
+        Check if the database uses incremental vacuum
+        """
+        return Query.connections.reader().execute("PRAGMA auto_vacuum;").fetchone()[0] == 2
+
+    @staticmethod
+    def __record(task, seconds, size_before, size_after, result):
+        """
+        Save when a task ran
+        """
+        with Query.connections.acquire(write=True) as db:
+            Query.schema.ensure(db, LOG_MODEL)
+            db.execute("INSERT OR REPLACE INTO {} ({}) VALUES (?, ?, ?, ?, ?, ?);".format(
+                LOG_TABLE, ", ".join(LOG_MODEL["fields"])),
+                (task, datetime.today().strftime("%Y-%m-%dT%H:%M:%S"), round(seconds, 3),
+                 size_before, size_after, result))
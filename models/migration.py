@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Schema migration module"""
+
+import logging
+from datetime import datetime
+
+from models.builders.build_create_query import build_create_query
+from models.builders.build_index_query import build_index_query
+
+__module__ = "migration"
+
+VERSION_TABLE = "schema_versions"
+VERSION_MODEL = {
+    "name": VERSION_TABLE,
+    "fields": ("table_name", "version", "definition", "migrated"),
+    "types": ("TEXT PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "TEXT NOT NULL", "TEXT")
+}
+
+
+def definition(model):
+    """
+    Text identifying the table layout of a model
+    Args:
+        model: table model definition
+    Returns:
+        create statement for the model
+    """
+    return build_create_query(model)
+
+
+def filler(column):
+    """
+    Value for a new NOT NULL column without default when rows are copied
+    Args:
+        column: table_info row
+    Returns:
+        sql literal
+    """
+    kind = (column[2] or "").upper()
+    if "INT" in kind or "REAL" in kind or "FLOA" in kind or "DOUB" in kind or "NUM" in kind:
+        return "0"
+    return "''"
+
+
+class SchemaMigrator:
+    """
+    Brings a live table in line with its model definition
+    New trailing columns are added with ALTER TABLE ADD COLUMN
+    any other change copies the rows into a new table which replaces the old one
+    Every migration runs in one savepoint and bumps the version recorded in schema_versions
+    """
+
+    def __init__(self):
+        """
+        Initialize SchemaMigrator class
+        """
+        self._log = logging.getLogger("eordre.query")
+
+    @staticmethod
+    def versions(db):
+        """
+        Recorded table versions
+        Args:
+            db: sqlite3 connection - schema_versions has to exist
+        Returns:
+            dict of table name with (version, definition)
+        """
+        rows = db.execute("SELECT table_name, version, definition FROM {};".format(VERSION_TABLE)).fetchall()
+        return {name: (version, text) for name, version, text in rows}
+
+    @staticmethod
+    def columns(db, table, schema="main"):
+        """
+        Live columns of a table
+        Args:
+            db: sqlite3 connection
+            table: table name
+            schema: database name
+        Returns:
+            list of (cid, name, type, notnull, default, pk)
+        """
+        return db.execute("PRAGMA {}.table_info({});".format(schema, table)).fetchall()
+
+    def expected(self, db, model):
+        """
+        Columns the model would create
+        The model is created as a temporary table and read back so both sides
+        are normalized by sqlite the same way
+        Args:
+            db: sqlite3 connection
+            model: table model definition
+        Returns:
+            list of (cid, name, type, notnull, default, pk)
+        """
+        scratch = "migrate_{}".format(model["name"])
+        db.execute("DROP TABLE IF EXISTS temp.{};".format(scratch))
+        db.execute(build_create_query(dict(model, name="temp.{}".format(scratch))))
+        try:
+            return self.columns(db, scratch, "temp")
+        finally:
+            db.execute("DROP TABLE temp.{};".format(scratch))
+
+    def plan(self, db, model):
+        """
+        Compare model and live table
+        Args:
+            db: sqlite3 connection
+            model: table model definition
+        Returns:
+            tuple with action - current, add or rebuild - and the live and expected columns
+        """
+        live = self.columns(db, model["name"])
+        expected = self.expected(db, model)
+        shape = [column[1:] for column in live]
+        wanted = [column[1:] for column in expected]
+        if shape == wanted:
+            return "current", live, expected
+        if wanted[:len(shape)] == shape:
+            # trailing columns can be added when sqlite allows it without a rebuild
+            addable = all(not column[5] and not (column[3] and column[4] is None)
+                          for column in expected[len(live):])
+            if addable:
+                return "add", live, expected
+        return "rebuild", live, expected
+
+    def migrate(self, db, model, version=0):
+        """
+        Migrate a live table to its model definition and record the new version
+        Args:
+            db: sqlite3 connection
+            model: table model definition
+            version: recorded version of the table
+        Returns:
+            tuple with action taken - current, add or rebuild - and the new version
+        """
+        name = model["name"]
+        savepoint = "migrate_{}".format(name)
+        db.execute("SAVEPOINT {};".format(savepoint))
+        try:
+            action, live, expected = self.plan(db, model)
+            if action == "add":
+                self.__add_columns(db, model, len(live))
+            elif action == "rebuild":
+                self.__rebuild(db, model, live, expected)
+            if action != "current" or not version:
+                version += 1
+            self.record(db, model, version)
+        except BaseException:
+            db.execute("ROLLBACK TO {};".format(savepoint))
+            db.execute("RELEASE {};".format(savepoint))
+            raise
+        db.execute("RELEASE {};".format(savepoint))
+        if action != "current":
+            self._log.info("migrated %s to version %d (%s)", name, version, action)
+        return action, version
+
+    @staticmethod
+    def record(db, model, version):
+        """
+        Record the version of a table
+        Args:
+            db: sqlite3 connection
+            model: table model definition
+            version: version number
+        """
+        db.execute("INSERT OR REPLACE INTO {} (table_name, version, definition, migrated) "
+                   "VALUES (?, ?, ?, ?);".format(VERSION_TABLE),
+                   (model["name"], version, definition(model), datetime.today().isoformat()))
+
+    @staticmethod
+    def __add_columns(db, model, start):
+        """
+        Add the model fields from start as new columns
+        """
+        for field, define in list(zip(model["fields"], model["types"]))[start:]:
+            db.execute("ALTER TABLE {} ADD COLUMN {} {};".format(model["name"], field, define))
+
+    @staticmethod
+    def __rebuild(db, model, live, expected):
+        """
+        Copy the rows to a table created from the model and swap it in
+        Columns are matched by name - dropped columns are left behind
+        """
+        name = model["name"]
+        target = "{}_migrate".format(name)
+        present = {column[1] for column in live}
+        columns = []
+        values = []
+        for column in expected:
+            if column[1] in present:
+                columns.append(column[1])
+                values.append(column[1])
+            elif column[3] and column[4] is None and not column[5]:
+                columns.append(column[1])
+                values.append(filler(column))
+        db.execute("DROP TABLE IF EXISTS {};".format(target))
+        db.execute(build_create_query(dict(model, name=target)))
+        db.execute("INSERT INTO {} ({}) SELECT {} FROM {};".format(
+            target, ", ".join(columns), ", ".join(values), name))
+        db.execute("DROP TABLE {};".format(name))
+        db.execute("ALTER TABLE {} RENAME TO {};".format(target, name))
+        for index in model.get("indexes", ()):
+            db.execute(build_index_query(model, index))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Model base module"""
+
+from operator import itemgetter
+
+from models.query import Query
+from models.row import row_class
+
+__module__ = "model"
+
+
+class Model:
+    """
+    Base for the table models
+    The model dict is a class attribute - the row class, the field positions and
+    the statements used by every model are compiled once when the class is defined
+    and shared by all instances
+    """
+    model = None
+    models = []  # every model class in definition order
+    q = Query()
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Compile the model of a subclass
+        """
+        super().__init_subclass__(**kwargs)
+        model = cls.__dict__.get("model")
+        if model is None:
+            return
+        fields = tuple(model["fields"])
+        key = [(model["id"], "=")]
+        cls._row = row_class(model)
+        cls._positions = {field: idx for idx, field in enumerate(fields)}
+        # values for the update statement - all fields but the id followed by the id
+        cls._update_values = itemgetter(*(fields[1:] + fields[:1]))
+        cls._sql = {
+            "insert": Query.build("insert", model),
+            "select": Query.build("select", model),
+            "select_id": Query.build("select", model, filters=key),
+            "update": Query.build("update", model, update=fields[1:], filters=key),
+            "upsert": Query.build("upsert", model),
+            "delete_id": Query.build("delete", model, filters=key),
+            "delete_all": Query.build("delete", model)
+        }
+        Model.models.append(cls)
+
+    def __init__(self):
+        """
+        Make sure the table exists in its current version
+        """
+        self.q.ensure_schema(self.model)
+
+    def clear(self):
+        """
+        Clear internal variables
+        """
+
+    def insert(self, values):
+        """
+        Insert a row
+        Args:
+            values: tuple with a value for every field
+        Returns:
+            rowid or False
+        """
+        success, data = self.q.execute(self._sql["insert"], values=values)
+        if success and data:
+            return data
+        return False
+
+    def insert_many(self, rows):
+        """
+        Insert a batch of rows in one transaction
+        Args:
+            rows: iterable of value tuples
+        Returns:
+            number of rows inserted
+        """
+        success, data = self.q.execute_many(self._sql["insert"], rows)
+        if success:
+            return data[0]
+        return False
+
+    def upsert(self, values):
+        """
+        Insert a row or update the row with the same unique key
+        The key is the first unique index of the model or the id
+        Args:
+            values: tuple with a value for every field
+        Returns:
+            bool
+        """
+        success, data = self.q.execute(self._sql["upsert"], values=values)
+        return success
+
+    def upsert_many(self, rows):
+        """
+        Insert or update a batch of rows in one transaction
+        Args:
+            rows: iterable of value tuples
+        Returns:
+            number of rows inserted or updated
+        """
+        success, data = self.q.execute_many(self._sql["upsert"], rows)
+        if success:
+            return data[0]
+        return False
+
+    def recreate_table(self):
+        """
+        Empty the table - the schema and indexes are kept
+        """
+        self.q.execute(self._sql["delete_all"])
+        self.clear()
+
+    def select_id(self, row_id):
+        """
+        Row with id
+        Args:
+            row_id:
+        Returns:
+            row or None
+        """
+        success, data = self.q.execute(self._sql["select_id"], values=(row_id,))
+        if success and data:
+            return self._row(*data[0])
+        return None
+
+    def update_row(self, row):
+        """
+        Write a row back to the table
+        Args:
+            row: row or dict with every field
+        Returns:
+            bool
+        """
+        success, data = self.q.execute(self._sql["update"], values=self._update_values(row))
+        return success
+
+    def update_many(self, rows):
+        """
+        Write rows back to the table in one transaction
+        Args:
+            rows: iterable of rows or dicts with every field
+        Returns:
+            number of rows updated
+        """
+        success, data = self.q.execute_many(self._sql["update"], map(self._update_values, rows))
+        if success:
+            return data[0]
+        return False
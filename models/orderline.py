@@ -8,38 +8,36 @@
 Visit details module
 """
 
-from models.query import Query
+from models.model import Model
 from util import utils, printFn as p
 
 __module__ = "orderline"
 
 
-class OrderLine:
+class OrderLine(Model):
     """
     OrderLine class
     """
+    model = {
+        "name": "orderlines",
+        "id": "line_id",
+        "fields": ("line_id", "visit_id",
+                   "pcs", "sku", "text", "price", "sas", "discount",
+                   "linetype", "linenote", "item"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL",
+                  "INTEGER", "TEXT", "TEXT", "REAL", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
+                  "TEXT", "TEXT", "TEXT"),
+        "indexes": (("visit_id",),)
+    }
 
     def __init__(self):
         """
         Initialize OrderLine class
         """
-        self.model = {
-            "name": "orderlines",
-            "id": "line_id",
-            "fields": ("line_id", "visit_id",
-                       "pcs", "sku", "text", "price", "sas", "discount",
-                       "linetype", "linenote", "item"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL",
-                      "INTEGER", "TEXT", "TEXT", "REAL", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
-                      "TEXT", "TEXT", "TEXT")
-        }
         self._line = {}
         self._lines = []
         self._csv_record_length = 8
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def line(self):
@@ -119,13 +117,8 @@ class OrderLine:
         Returns:
             bool
         """
-        filters = [(self.model["id"], "=")]
-        values = (orderline_id,)
-        sql = self.q.build("delete", self.model, filters=filters)
-        success, data = self.q.execute(sql, values)
-        if success and data:
-            return True
-        return False
+        success, data = self.q.execute(self._sql["delete_id"], values=(orderline_id,))
+        return success
 
     def find(self, line_id):
         """
@@ -135,48 +128,41 @@ class OrderLine:
         Returns:
             bool
         """
-        filters = [(self.model["id"], "=")]
-        values = (line_id,)
-        sql = self.q.build("select", self.model, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success:
-            try:
-                self._line = dict(zip(self.model["fields"], data[0]))
-                return True
-            except IndexError:
-                self._line = {}
-        return False
+        line = self.select_id(line_id)
+        if line is None:
+            self._line = {}
+            return False
+        self._line = line
+        return True
 
     def translate_row_insert(self, row):
         """
-        Translate a csv row
+        Translate a csv row and insert it
         Args:
             row:
         """
-        # translate bool text to integer col 6
-        field_6 = utils.bool2int(utils.arg2bool(row[6]))
-        new_row = (row[0], row[1], row[2], row[3].strip(), row[4].strip(), row[5], field_6, row[7], "S", "", "")
-        self.insert(new_row)
+        self.insert(self.translate_row(row))
 
-    def insert(self, values):
+    def translate_row(self, row):
         """
-        Insert a new line with values
+        Translate a csv row
         Args:
-            values:
+            row:
         Returns:
-            rownumber or None
+            tuple with values for insert
         """
-        sql = self.q.build("insert", self.model)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
-        return None
+        # translate bool text to integer col 6
+        field_6 = utils.bool2int(utils.arg2bool(row[6]))
+        new_row = (row[0], row[1], row[2], row[3].strip(), row[4].strip(), row[5], field_6, row[7], "S", "", "")
+        return new_row
 
-    def load_visit(self, visit_id):
+    def load_visit(self, visit_id, visit_date=None):
         """
         Load order lines for visit_id
+        The archive is read when visit_date is in an archived year - ids may be reused after archiving
         Args:
             visit_id:
+            visit_date: date of the visit
         Returns:
             bool: True on success
         """
@@ -185,8 +171,12 @@ class OrderLine:
         sql = self.q.build("select", self.model, filters=filters)
         success, data = self.q.execute(sql, values=values)
         if success:
+            years = self.q.archives.between(visit_date, visit_date) if visit_date else []
+            if years:
+                # lines of a visit from an archived year - the table holds lines of a visit created since
+                data = self.q.archives.select(self.model, filters=filters, values=values, years=years) or data
             try:
-                self._lines = [dict(zip(self.model["fields"], row)) for row in data]
+                self._lines = [self._row(*row) for row in data]
                 self._line = self.list_[0]
                 return True
             except (IndexError, KeyError):
@@ -194,40 +184,27 @@ class OrderLine:
                 self._lines = []
         return False
 
-    def recreate_table(self):
-        """
-        Recrete table and clears internal variables
-        """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
-
     def save_all(self):
         """
         Save the list of lines
+        New lines are inserted and existing lines updated in one batch each
         """
+        new_lines = []
+        old_lines = []
         for line in self._lines:
             if line[self.model["id"]] is None:
-                self.insert(line.values())
+                new_lines.append(tuple(line.values()))
             else:
-                self._line = line
-                self.update()
+                old_lines.append(line)
+        if new_lines:
+            self.insert_many(new_lines)
+        if old_lines:
+            self.update_many(old_lines)
 
     def update(self):
         """
         Update line data in database
         Returns:
-            rownumber or None
-        """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._line.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        if sql.startswith("ERROR"):
-            return None
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
-        return None
+            bool
+        """
+        return self.update_row(self._line)
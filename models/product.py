@@ -6,35 +6,37 @@
 
 """"product module"""
 
-from models.query import Query
+import json
+import sqlite3
+
+from models.connection import Rollback
+from models.model import Model
 
 __module__ = "product"
 
 
-class Product:
+class Product(Model):
     """
     Product
     """
+    model = {
+        "name": "products",
+        "id": "product_id",
+        "fields": ("product_id", "sku", "name1", "name2", "name3", "item", "price",
+                   "d2", "d4", "d6", "d8", "d12", "d24", "d48", "d96", "min", "net", "groupid"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT", "TEXT", "TEXT", "TEXT", "TEXT",
+                  "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0",
+                  "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0",
+                  "REAL DEFAULT 0", "TEXT"),
+        "indexes": ({"fields": ("sku",), "unique": True},)}
 
     def __init__(self):
         """
         Initialize product class
         """
-        self.model = {
-            "name": "products",
-            "id": "product_id",
-            "fields": ("product_id", "sku", "name1", "name2", "name3", "item", "price",
-                       "d2", "d4", "d6", "d8", "d12", "d24", "d48", "d96", "min", "net", "groupid"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT", "TEXT", "TEXT", "TEXT", "TEXT",
-                      "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0",
-                      "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0",
-                      "REAL DEFAULT 0", "TEXT")}
         self._product = {}
         self._products = []
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def product(self):
@@ -74,8 +76,8 @@ class Product:
 
     def drop_table(self):
         """
-        Drop the product table
-        The table can be safely recreated.
+        Empty the product table
+        The table can be safely emptied.
         An internal pointer to a specific product id is not used as line will contain the product sku etc
         This approach also eliminates a current issue with deprecated products
         """
@@ -85,40 +87,80 @@ class Product:
         """
         Insert a product in database
         Args:
-            values:
+            values: product values without the product_id
         """
-        values = list(values)
-        values[0:0] = [None]
-        values = tuple(values)
+        return super().insert((None,) + tuple(values))
 
-        sql = self.q.build("insert", self.model)
+    def insert_many(self, rows):
+        """
+        Insert a batch of products in one transaction
+        Args:
+            rows: iterable of value tuples without the product_id
+        Returns:
+            number of rows inserted
+        """
+        return super().insert_many((None,) + tuple(row) for row in rows)
 
-        success, data = self.q.execute(sql, values=values)
+    def upsert_many(self, rows):
+        """
+        Insert or update a batch of products by sku in one transaction
+        Args:
+            rows: iterable of value tuples without the product_id
+        Returns:
+            number of rows inserted or updated
+        """
+        return super().upsert_many((None,) + tuple(row) for row in rows)
 
-        if success and data:
-            return data
-        return False
+    def sync(self, rows):
+        """
+        Merge the product list from the server
+        Products are updated by sku and keep their product_id - products
+        missing from the list are deleted - all in one transaction
+        Args:
+            rows: list of value tuples without the product_id
+        Returns:
+            number of rows inserted or updated
+        """
+        rows = list(rows)
+        count = False
+        with self.q.transaction():
+            count = self.upsert_many(rows)
+            if count is False:
+                raise Rollback
+            sql = "DELETE FROM {} WHERE sku NOT IN (SELECT value FROM json_each(?));".format(self.model["name"])
+            success, data = self.q.execute(sql, values=(json.dumps([row[0] for row in rows]),))
+            if not success:
+                count = False
+                raise Rollback
+        if count is False:
+            # no unique sku index - the table is replaced and the index created on the clean rows
+            self.recreate_table()
+            count = self.insert_many(rows)
+            self.q.create_indexes(self.model)
+        self.clear()
+        return count
 
-    def recreate_table(self):
+    def iter_products(self):
         """
-        Drop and init_detail table
+        Stream products without building the full list
+        Returns:
+            generator of products
         """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
+        row_type = self._row
+        for row in self.q.iter_rows(self._sql["select"]):
+            yield row_type(*row)
 
     def __get_all(self):
         """
         Load product list
         """
-        sql = self.q.build("select", self.model)
-        success, data = self.q.execute(sql)
-        if success and data:
-            self._products = [dict(zip(self.model["fields"], row)) for row in data]
+        try:
+            self._products = list(self.iter_products())
+        except sqlite3.Error:
+            self._products = []
+        try:
             self._product = self._products[0]
-        else:
+        except IndexError:
             self._product = {}
             self._products = []
 
@@ -127,11 +169,4 @@ class Product:
         Set current product
         :param product_id:
         """
-        filters = [("product_id", "=")]
-        values = (product_id,)
-        sql = self.q.build("select", self.model, filters=filters)
-        success, data = self.q.execute(sql, values)
-        if success and data:
-            self._product = dict(zip(self.model["fields"], data[0]))
-        else:
-            self._product = {}
+        self._product = self.select_id(product_id) or {}
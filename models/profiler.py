@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Query profiling module"""
+
+import logging
+import math
+import os
+import re
+import sys
+import threading
+
+from configuration import config
+
+__module__ = "profiler"
+
+_IN_LIST = re.compile(r"IN \((\?,\s*)*\?\)", re.IGNORECASE)
+_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+_STRING = re.compile(r"'[^']*'")
+_SPACES = re.compile(r"\s+")
+_INTERNAL = ("connection.py", "model.py", "profiler.py", "query.py")
+
+
+def fingerprint(sql):
+    """
+    Normalize a statement so variants of the same query are counted together
+    Args:
+        sql:
+
+    Returns:
+        sql with literals replaced by ? and IN lists collapsed
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (?+)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def caller():
+    """
+    Name of the model method which issued the query
+    Returns:
+        string with module.method
+    """
+    frame = sys._getframe(1)
+    while frame and os.path.basename(frame.f_code.co_filename) in _INTERNAL:
+        frame = frame.f_back
+    if frame is None:
+        return ""
+    name = getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+    return "{}.{}".format(frame.f_globals.get("__name__", ""), name)
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile
+    Args:
+        values: sorted list
+        pct: 0 - 100
+
+    Returns:
+        the value at pct
+    """
+    if not values:
+        return 0.0
+    idx = max(0, math.ceil(pct / 100.0 * len(values)) - 1)
+    return values[min(idx, len(values) - 1)]
+
+
+class QueryProfiler:
+    """
+    Collects timing per statement and logs the slow ones
+    """
+
+    def __init__(self):
+        """
+        Initialize QueryProfiler class
+        """
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._log = None
+
+    @property
+    def enabled(self):
+        """
+        Profiling is switched on in configuration
+        """
+        return config.QUERY_PROFILE
+
+    def record(self, sql, values, elapsed, rows):
+        """
+        Record a statement execution
+        Args:
+            sql: statement
+            values: parameters
+            elapsed: wall time in seconds
+            rows: rows returned or affected
+        """
+        key = fingerprint(sql)
+        params = len(values) if values else 0
+        method = caller()
+        thread = threading.current_thread().name
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = {"count": 0, "total": 0.0, "rows": 0, "times": [], "callers": set()}
+                self._stats[key] = entry
+            entry["count"] += 1
+            entry["total"] += elapsed
+            entry["rows"] += rows if rows and rows > 0 else 0
+            entry["callers"].add(method)
+            # keep a bounded sample for the percentiles
+            if len(entry["times"]) < config.QUERY_PROFILE_SAMPLES:
+                entry["times"].append(elapsed)
+            else:
+                entry["times"][entry["count"] % config.QUERY_PROFILE_SAMPLES] = elapsed
+        if elapsed * 1000 >= config.SLOW_QUERY_MS:
+            self.logger().warning("slow query %.1f ms | %s | params=%d | rows=%s | %s | %s",
+                                  elapsed * 1000, key, params, rows, method, thread)
+
+    def logger(self):
+        """
+        Logger writing to config.LOGPATH
+        """
+        if self._log is None:
+            log = logging.getLogger("eordre.query")
+            if not log.handlers:
+                try:
+                    os.makedirs(os.path.dirname(config.LOGPATH) or ".", exist_ok=True)
+                    handler = logging.FileHandler(config.LOGPATH, encoding="utf-8")
+                except OSError:
+                    handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+                log.addHandler(handler)
+                log.setLevel(logging.INFO)
+                log.propagate = False
+            self._log = log
+        return self._log
+
+    def summary(self):
+        """
+        Per fingerprint summary ordered by total time
+        Returns:
+            list of dicts with sql, count, p50, p95, total (ms), rows and callers
+        """
+        with self._lock:
+            items = [(key, dict(entry, times=sorted(entry["times"]), callers=sorted(entry["callers"])))
+                     for key, entry in self._stats.items()]
+        result = []
+        for key, entry in items:
+            result.append({"sql": key,
+                           "count": entry["count"],
+                           "p50": percentile(entry["times"], 50) * 1000,
+                           "p95": percentile(entry["times"], 95) * 1000,
+                           "total": entry["total"] * 1000,
+                           "rows": entry["rows"],
+                           "callers": entry["callers"]})
+        return sorted(result, key=lambda item: item["total"], reverse=True)
+
+    def report(self, limit=None):
+        """
+        Summary as text table
+        Args:
+            limit: max number of statements
+
+        Returns:
+            string
+        """
+        lines = ["{:>7} {:>9} {:>9} {:>10}  {}".format("count", "p50 ms", "p95 ms", "total ms", "sql")]
+        for item in self.summary()[:limit]:
+            lines.append("{:>7} {:>9.2f} {:>9.2f} {:>10.2f}  {}".format(
+                item["count"], item["p50"], item["p95"], item["total"], item["sql"]))
+        return "\n".join(lines)
+
+    def dump(self):
+        """
+        Write the summary to the log
+        """
+        if self._stats:
+            self.logger().info("query summary\n%s", self.report())
+
+    def clear(self):
+        """
+        Reset collected statistics
+        """
+        with self._lock:
+            self._stats = {}
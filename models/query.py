@@ -7,14 +7,25 @@
 """Sqlite Query Module"""
 
 import sqlite3
+import time
+from contextlib import contextmanager
+from itertools import islice
 
 from configuration import config
+from models.archive import ArchiveManager
+from models.connection import ConnectionManager
+from models.profiler import QueryProfiler
+from models.result_cache import ResultCache
+from models.schema import SchemaRegistry
 from models.builders.build_create_query import build_create_query
 from models.builders.build_delete_query import build_delete_query
 from models.builders.build_drop_query import build_drop_query
+from models.builders.build_index_query import build_index_query
 from models.builders.build_insert_query import build_insert_query
 from models.builders.build_select_query import build_select_query
 from models.builders.build_update_query import build_update_query
+from models.builders.build_upsert_query import build_upsert_query
+from models.builders.statement_cache import StatementCache, freeze
 
 __module__ = "query"
 
@@ -23,37 +34,70 @@ class Query:
     """
     Query Build and Execute
     """
+    connections = ConnectionManager()
+    statements = StatementCache(config.DB_STATEMENT_CACHE)
+    results = ResultCache(config.DB_RESULT_CACHE, config.DB_RESULT_CACHE_ROWS)
+    profiler = QueryProfiler()
+    schema = SchemaRegistry()
+    archives = ArchiveManager(connections)
+    # tables created in a rolled back transaction are gone again
+    connections.on_rollback(schema.reset)
+    # results read meanwhile may hold rows which were rolled back or not yet committed
+    connections.on_rollback(results.clear)
+    connections.on_commit(results.commit)
 
     @staticmethod
-    def build(query_type, model_def, selection=None, update=None, aggregates=None, filters=None, orderby=None):
+    def build(query_type, model_def, selection=None, update=None, aggregates=None, filters=None, orderby=None,
+              limit=None, offset=None):
         """
         Builds a sql query from definition
 
         Args:
-            query_type: create(table), drop(table), insert(row), select(row), update(row), delete(row))
+            query_type: create(table), drop(table), insert(row), select(row), update(row), delete(row),
+            upsert(row) - insert or update on the first unique index of the model or the id
 
             model_def: table model definition
-            {"name": ("name" ...), "fields": ("field" ...), "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT" ...)}
+            {"name": ("name" ...), "fields": ("field" ...), "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT" ...),
+             "indexes": (("field", "field"), {"fields": ("field",), "unique": True, "where": "expression"} ...)}
 
             selection: limit the result to selection
 
-            update: fields to update
+            update: fields to update - for upsert the fields updated on conflict
             ("field", "field" ...)
 
             aggregates: valid ["sum(column) AS 'expression'", "sum(column) AS 'expression'" ....]
 
             filters:  valid for all-, required for update- and delete query
-            [("field", "operator", "value", "and/or"), (("field", "operator", "value"))]]
+            [("field", "operator", "and/or"), ("field", "operator")]
+            select also takes ("field", "between") and ("field", ("in", count)) for a list of count values
 
-            orderby: asc or desc
+            orderby: ("field", "asc/desc") or [("field", "asc/desc"), ("field", "asc/desc") ...]
+
+            limit: select at most limit rows
+
+            offset: skip offset rows - used with limit for paging or alone to skip rows
 
         Returns:
             string with sql query
 
         """
+        key = (query_type.upper(), model_def["name"], freeze(selection), freeze(update),
+               freeze(aggregates), freeze(filters), freeze(orderby), limit, offset)
+        sql = Query.statements.get(key)
+        if sql is None:
+            sql = Query.__compile(query_type, model_def, selection, update, aggregates, filters, orderby,
+                                  limit, offset)
+            if not sql.startswith("ERROR"):
+                Query.statements.put(key, sql)
+        return sql
 
+    @staticmethod
+    def __compile(query_type, model_def, selection, update, aggregates, filters, orderby, limit, offset):
+        """
+        Builds the sql text - see build
+        """
         querytype = query_type.upper()
-        if querytype not in ["CREATE", "DELETE", "DROP", "INSERT", "SELECT", "UPDATE"]:
+        if querytype not in ["CREATE", "DELETE", "DROP", "INSERT", "SELECT", "UPDATE", "UPSERT"]:
             return "ERROR! Unsupported type: {}, {}".format(querytype, model_def["name"])
 
         if querytype == ["DELETE"]:
@@ -64,11 +108,6 @@ class Query:
             if not filters or not update:
                 return "ERROR! Missing 'update' or 'filters' for: {}, {}".format(querytype, model_def["name"])
 
-        if orderby:
-            orderby = orderby[1].upper()
-            if not orderby == "ASC" or not orderby == "DESC":
-                orderby = "ASC"
-
         # build init_detail table query
         if querytype == "CREATE":
             return build_create_query(model_def)
@@ -87,12 +126,16 @@ class Query:
 
         # build all row query
         if querytype == "SELECT":
-            return build_select_query(model_def, selection, aggregates, filters, orderby)
+            return build_select_query(model_def, selection, aggregates, filters, orderby, limit, offset)
 
         # build update row query
         if querytype == "UPDATE":
             return build_update_query(model_def, update, filters)
 
+        # build insert or update row query
+        if querytype == "UPSERT":
+            return build_upsert_query(model_def, update)
+
     @staticmethod
     def execute(sql_query, values=None):
         """
@@ -107,24 +150,241 @@ class Query:
         # the select and insert query has to return the result
         select = sql_query.startswith("SELECT")  # returns data
         insert = sql_query.startswith("INSERT")  # returns rowid for the last inserted record
-        db = sqlite3.connect(config.DBPATH)
-        with db:
-            try:
+        # the connection is in autocommit mode - no commit is issued here
+        # writes outside a transaction block are committed by sqlite
+        # selects run on the reader connection and do not wait for a running write
+        # a transaction block or a snapshot reads rows other threads do not see - those are not cached
+        pending = Query.connections.in_transaction()
+        cached = select and not pending and not Query.connections.reader().in_transaction
+        if cached:
+            result = Query.results.get(sql_query, values)
+            if result is not None:
+                return True, result
+            versions = Query.results.versions(sql_query)
+        started = time.perf_counter()
+        try:
+            with Query.connections.acquire(write=not select) as db:
                 result = None
                 cur = db.cursor()
                 if values:
-                    cur.execute(sql_query, values)
+                    Query.connections.retry(lambda: cur.execute(sql_query, values))
                 else:
-                    cur.execute(sql_query)
-                db.commit()
+                    Query.connections.retry(lambda: cur.execute(sql_query))
                 if select:
                     result = cur.fetchall()
                 if insert:
                     result = cur.lastrowid
-            except (sqlite3.OperationalError, sqlite3.ProgrammingError) as e:
-                return False, e
+        except (sqlite3.OperationalError, sqlite3.ProgrammingError) as e:
+            return False, e
+        if Query.profiler.enabled:
+            Query.profiler.record(sql_query, values, time.perf_counter() - started,
+                                  len(result) if select else cur.rowcount)
+        if cached:
+            Query.results.put(sql_query, values, result, versions)
+        elif not select:
+            Query.results.written(sql_query, pending)
         return True, result
 
+    @staticmethod
+    def iter_rows(sql_query, values=None, chunk=None):
+        """
+        Execute a select and yield the rows without loading the whole result
+        Rows are fetched in chunks while the pooled connection stays open
+        A result of at most config.DB_RESULT_CACHE_ROWS rows read to the end is cached
+        Args:
+            sql_query:
+            values:
+            chunk: number of rows fetched per round trip
+        Returns:
+            generator of row tuples
+        Raises:
+            sqlite3.OperationalError, sqlite3.ProgrammingError when the read fails - the stream is
+            never ended early as if complete
+        """
+        if not chunk:
+            chunk = config.DB_FETCH_CHUNK
+        db = Query.connections.reader()
+        cached = not Query.connections.in_transaction() and not db.in_transaction
+        if cached:
+            result = Query.results.get(sql_query, values)
+            if result is not None:
+                yield from result
+                return
+            versions = Query.results.versions(sql_query)
+        result = []
+        started = time.perf_counter()
+        count = 0
+        cur = db.cursor()
+        try:
+            if values:
+                Query.connections.retry(lambda: cur.execute(sql_query, values))
+            else:
+                Query.connections.retry(lambda: cur.execute(sql_query))
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    if cached:
+                        Query.results.put(sql_query, values, result, versions)
+                    break
+                count += len(rows)
+                if cached:
+                    result.extend(rows)
+                    # too large to keep - stream the rest
+                    cached = count <= config.DB_RESULT_CACHE_ROWS
+                    if not cached:
+                        result = []
+                yield from rows
+        finally:
+            try:
+                cur.close()
+            except sqlite3.ProgrammingError:
+                # the connection is gone - the error of the read is raised
+                pass
+            if Query.profiler.enabled:
+                Query.profiler.record(sql_query, values, time.perf_counter() - started, count)
+
+    @staticmethod
+    def execute_many(sql_query, rows, batch_size=None):
+        """
+        Execute a query for each row in one transaction
+        Args:
+            sql_query:
+            rows: iterable of value tuples
+            batch_size: number of rows handed to sqlite per executemany call
+        Returns:
+            tuple with number of rows affected and rowid of the last inserted row
+        """
+        if not batch_size:
+            batch_size = config.DB_BATCH_SIZE
+        rows = iter(rows)
+        count = 0
+        started = time.perf_counter()
+        try:
+            with Query.connections.transaction() as db:
+                cur = db.cursor()
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    cur.executemany(sql_query, batch)
+                    count += cur.rowcount
+                lastrowid = cur.execute("SELECT last_insert_rowid();").fetchone()[0]
+        except (sqlite3.OperationalError, sqlite3.ProgrammingError, sqlite3.IntegrityError) as e:
+            return False, e
+        if Query.profiler.enabled:
+            Query.profiler.record(sql_query, None, time.perf_counter() - started, count)
+        Query.results.written(sql_query, Query.connections.in_transaction())
+        return True, (count, lastrowid)
+
+    @staticmethod
+    def transaction():
+        """
+        Group the statements executed in the block in one transaction
+        Usage:
+            with Query.transaction():
+                Query.execute(...)
+                Query.execute(...)
+        Raise models.connection.Rollback in the block to discard the statements
+        """
+        return Query.connections.transaction()
+
+    @staticmethod
+    def snapshot():
+        """
+        Read the statements executed in the block from one consistent snapshot
+        Usage:
+            with Query.snapshot():
+                customer.lookup(...)
+                contact.load_for_customer(...)
+        """
+        return Query.connections.snapshot()
+
+    @staticmethod
+    @contextmanager
+    def profile(name):
+        """
+        Run the block with another performance profile and restore the previous one
+        The profile applies to the calling thread - writes from other threads keep their own
+        Usage:
+            with Query.profile("bulk_import"):
+                model.insert_many(rows)
+        Args:
+            name: key in config.DB_PROFILES
+        """
+        previous = Query.connections.profile
+        Query.connections.profile = name
+        try:
+            yield
+        finally:
+            Query.connections.profile = previous
+
+    @staticmethod
+    def use_storage(name):
+        """
+        Switch between the database file and a shared in-memory database
+        Usage:
+            Query.use_storage("memory")
+        Args:
+            name: disk or memory
+        """
+        Query.connections.storage = name
+        Query.schema.reset()
+        Query.results.clear()
+
+    @staticmethod
+    def pragmas():
+        """
+        Effective connection pragmas
+        Returns:
+            dict with pragma name and value
+        """
+        return Query.connections.pragmas()
+
+    @staticmethod
+    def close():
+        """
+        Close the pooled connections
+        """
+        Query.connections.close()
+        Query.archives.close()
+        Query.schema.reset()
+        Query.results.clear()
+
+    @staticmethod
+    def release():
+        """
+        Release the connection of the calling thread
+        Worker threads call this when their job is done
+        """
+        Query.connections.release()
+
+    @staticmethod
+    def connection_stats():
+        """
+        Connection counters
+        Returns:
+            dict with opened, reused, closed, released and retried counts
+        """
+        return Query.connections.stats
+
+    @staticmethod
+    def statement_stats():
+        """
+        Statement cache counters
+        Returns:
+            dict with hits, misses and size
+        """
+        return Query.statements.stats
+
+    @staticmethod
+    def result_stats():
+        """
+        Result cache counters
+        Returns:
+            dict with hits, misses, stale and size
+        """
+        return Query.results.stats
+
     @staticmethod
     def values_to_update(values):
         """
@@ -142,6 +402,31 @@ class Query:
         work = tuple(work)
         return work
 
+    def create_indexes(self, model_def):
+        """
+        Create the indexes declared in a model definition if missing
+        Args:
+            model_def: table model definition
+        """
+        for index in model_def.get("indexes", ()):
+            self.execute(build_index_query(model_def, index))
+
+    def ensure_schema(self, model_def):
+        """
+        Create table and indexes for a model unless already known
+        sqlite_master is read once for all models
+        Args:
+            model_def: table model definition
+        """
+        try:
+            with self.connections.acquire(write=True) as db:
+                if self.schema.ensure(db, model_def):
+                    # a migrated table returns other columns
+                    self.results.touch(model_def["name"])
+        except sqlite3.DatabaseError as e:
+            return False, e
+        return True, None
+
     def exist_table(self, table):
         """
         Check database if tablename exist
@@ -151,8 +436,4 @@ class Query:
         Returns:
              bool indicating if table was found
         """
-        statement = "SELECT name FROM sqlite_master " \
-                    "WHERE type='{}' " \
-                    "AND name='{}';".format("table", table)
-        success, data = self.execute(statement)
-        return bool(data)
+        return self.schema.exists(self.connections.reader(), table)
@@ -6,51 +6,51 @@
 
 """Report class"""
 
+import sqlite3
 from datetime import datetime
 from operator import itemgetter
 
+from models.connection import Rollback
 from models.reportcalculator import ReportCalculator
-from models.query import Query
+from models.model import Model
 from util import utils
 
 __module__ = "report"
 
 
-class Report:
+class Report(Model):
     """
     Report
     """
+    model = {
+        "name": "reports",
+        "id": "report_id",
+        "fields": ("report_id", "employee_id", "rep_no", "rep_date", "timestamp",
+                   "newvisitday", "newdemoday", "newsaleday", "newturnoverday",
+                   "recallvisitday", "recalldemoday", "recallsaleday", "recallturnoverday",
+                   "sasday", "sasturnoverday", "demoday", "saleday",
+                   "kmmorning", "kmevening", "supervisor", "territory",
+                   "workday", "infotext", "sent", "offday", "offtext", "kmprivate"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL",
+                  "INTEGER NOT NULL", "INTEGER NOT NULL", "TEXT NOT NULL", "TEXT NOT NULL",
+                  "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
+                  "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
+                  "INTEGER DEFAULT 0", "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
+                  "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "TEXT", "TEXT",
+                  "INTEGER DEFAULT 0", "TEXT", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "TEXT",
+                  "INTEGER DEFAULT 0"),
+        "indexes": (("rep_date",), ("employee_id", "rep_date"))
+    }
 
     def __init__(self):
         """
         Initilize Report class
         """
-        self.model = {
-            "name": "reports",
-            "id": "report_id",
-            "fields": ("report_id", "employee_id", "rep_no", "rep_date", "timestamp",
-                       "newvisitday", "newdemoday", "newsaleday", "newturnoverday",
-                       "recallvisitday", "recalldemoday", "recallsaleday", "recallturnoverday",
-                       "sasday", "sasturnoverday", "demoday", "saleday",
-                       "kmmorning", "kmevening", "supervisor", "territory",
-                       "workday", "infotext", "sent", "offday", "offtext", "kmprivate"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL",
-                      "INTEGER NOT NULL", "INTEGER NOT NULL", "TEXT NOT NULL", "TEXT NOT NULL",
-                      "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
-                      "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
-                      "INTEGER DEFAULT 0", "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
-                      "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "TEXT", "TEXT",
-                      "INTEGER DEFAULT 0", "TEXT", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "TEXT",
-                      "INTEGER DEFAULT 0")
-        }
         self._reports = []
         self._report = {}
         self._csv_record_length = 25
-        self.q = Query()
         self.c = ReportCalculator()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def csv_record_length(self):
@@ -130,60 +130,52 @@ class Report:
                       "(sum(kmprivate)) AS 'kmprivate'",
                       "(sum(workday = 1)) AS 'workdays'",
                       "(sum(offday = 1)) AS 'offdays'"]
-        filters = [("rep_date", "LIKE", "and"), ("employee_id", "=", "and"), ("sent", "=")]
-        ym_filter = "{}%".format(workdate[:8])
+        # glob - unlike like - is case sensitive and can use the rep_date index
+        filters = [("rep_date", "GLOB", "and"), ("employee_id", "=", "and"), ("sent", "=")]
+        ym_filter = "{}*".format(workdate[:8])
         employee_id = employee["employee_id"]
         territory = employee["salesrep"]
         values = (ym_filter, employee_id, 1)
 
         sql = self.q.build("select", self.model, aggregates=aggregates, filters=filters)
 
-        success, data = self.q.execute(sql, values)
+        # aggregate, report and calculation are written as one unit
+        created = False
+        with self.q.transaction():
+            success, data = self.q.execute(sql, values)
 
-        if success and data:
-            # assign expected result from list item
-            try:
-                _ = data[0]
-            except IndexError:
-                return False
-            # temporary convert tuple to list
-            current_month_totals = list(data[0])
-            # extract report count from first column
-            report_count = int(current_month_totals[0])
-            # increment report count
-            next_report = report_count + 1
-            # init_detail a combined list with the identifiers and the totals
-            current_month_totals = [workdate, "None", employee_id] + current_month_totals
-            timestamp = datetime.today()
-            # init_detail tuple with values to initialze the new report
-            new_report_values = (None, employee_id, next_report, workdate, timestamp,
-                                 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                                 0, 0, "", territory, 1, "", 0, 0, "", 0)
-            # assign return value as new report_id
-            report_id = self.insert(new_report_values)
-            # insert report_id to identify for which report the totals was calculated
-            current_month_totals[1] = report_id
-            # revert to tuple
-            current_month_totals = tuple(current_month_totals)
-            # insert the values in the calculation table
-            self.c.insert(current_month_totals)
-            return True
-        else:
-            return False
-
-    def insert(self, values):
-        """
-        Insert new reportid in table
-        Args:
-            :type values: iterable
-        """
-        sql = self.q.build("insert", self.model)
-
-        success, data = self.q.execute(sql, values=values)
-
-        if success and data:
-            return data
-        return False
+            if success and data:
+                # assign expected result from list item
+                try:
+                    _ = data[0]
+                except IndexError:
+                    return False
+                # temporary convert tuple to list
+                current_month_totals = list(data[0])
+                # extract report count from first column
+                report_count = int(current_month_totals[0])
+                # increment report count
+                next_report = report_count + 1
+                # init_detail a combined list with the identifiers and the totals
+                current_month_totals = [workdate, "None", employee_id] + current_month_totals
+                timestamp = datetime.today()
+                # init_detail tuple with values to initialze the new report
+                new_report_values = (None, employee_id, next_report, workdate, timestamp,
+                                     0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                                     0, 0, "", territory, 1, "", 0, 0, "", 0)
+                # assign return value as new report_id
+                report_id = self.insert(new_report_values)
+                if not report_id:
+                    raise Rollback
+                # insert report_id to identify for which report the totals was calculated
+                current_month_totals[1] = report_id
+                # revert to tuple
+                current_month_totals = tuple(current_month_totals)
+                # insert the values in the calculation table
+                if not self.c.insert(current_month_totals):
+                    raise Rollback
+                created = True
+        return created
 
     def load(self, workdate=None, year=None, month=None):
         """
@@ -198,21 +190,28 @@ class Report:
 
     def recreate_table(self):
         """
-        Drop and initialize reports table
+        Empty the table - the schema and indexes are kept
         """
         self.c.recreate_table()
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
+        super().recreate_table()
 
     def translate_row_insert(self, row, employee_id):
+        """
+        Translate a csv row and insert it
+        Args:
+            :type row: iterable
+            :type employee_id: int
+        """
+        self.insert(self.translate_row(row, employee_id))
+
+    def translate_row(self, row, employee_id):
         """
         Translate a csv row
         Args:
             :type row: iterable
             :type employee_id: int
+        Returns:
+            tuple with values for insert
         """
         # translate bool text to integer for col 19, 21
         field_19 = utils.bool2int(utils.arg2bool(row[19]))
@@ -223,8 +222,7 @@ class Report:
                   row[4], row[5], row[6], row[7], row[8], row[9], row[10], row[11], row[12],
                   row[13], row[14], row[15], row[16], row[17].strip(), row[18].strip(),
                   field_19, row[20].strip(), field_21, row[22], row[23].strip(), row[24])
-
-        self.insert(values)
+        return values
 
     def update(self):
         """
@@ -257,37 +255,45 @@ class Report:
             try:
                 _ = self._reports[0]
                 for report in self._reports:
-                    if report["workdate"] == workdate:
+                    if report["rep_date"] == workdate:
                         self._report = report
                         return
             except (IndexError, KeyError):
                 pass
 
-        filters = [("rep_date", "like")]
-        value = "{}-{}-{}".format("%", "%", "%")
+        try:
+            self._reports = sorted(self.iter_by_period(year, month), key=itemgetter("rep_date"), reverse=True)
+        except sqlite3.Error:
+            self._reports = []
+        if not self._reports:
+            self._report = {}
+            return
+        if workdate:
+            for report in self._reports:
+                if report["rep_date"] == workdate:
+                    self._report = report
+                    break
+        if not self._report:
+            self._report = self._reports[0]
+
+    def iter_by_period(self, year=None, month=None):
+        """
+        Stream reports for a period or all reports if no args
+        Args:
+            :type year: str
+            :type month: str
+        Returns:
+            generator of reports
+        """
+        filters = [("rep_date", "glob")]
+        value = "{}-{}-{}".format("*", "*", "*")
         if year:
-            value = "{}-{}-{}".format(year, "%", "%")
+            value = "{}-{}-{}".format(year, "*", "*")
         if year and month:
-            value = "{}-{}-{}".format(year, month, "%")
+            value = "{}-{}-{}".format(year, month, "*")
 
         values = (value,)
+        row_type = self._row
         sql = self.q.build("select", self.model, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            try:
-                _ = data[0]
-                self._reports = [dict(zip(self.model["fields"], row)) for row in data]
-                self._reports = sorted(self._reports, key=itemgetter("rep_date"), reverse=True)
-                if workdate:
-                    for report in self._reports:
-                        if report["rep_date"] == workdate:
-                            self._report = report
-                            break
-                if not self._report:
-                    self._report = self._reports[0]
-            except IndexError:
-                self._report = {}
-                self._reports = []
-        else:
-            self._report = {}
-            self._reports = []
+        for row in self.q.iter_rows(sql, values=values):
+            yield row_type(*row)
@@ -8,38 +8,36 @@
 Calculation module
 """
 
-from models.query import Query
+from models.model import Model
 
 
-class ReportCalculator:
+class ReportCalculator(Model):
     """
     Calculator
     """
+    model = {
+        "name": "reportcalculations",
+        "id": "calc_id",
+        "fields": ("calc_id", "calc_date", "report_id", "employee_id", "reports_calculated",
+                   "new_visit", "new_demo", "new_sale", "new_turnover",
+                   "recall_visit", "recall_demo", "recall_sale", "recall_turnover",
+                   "sas", "sas_turnover", "current", "demo", "sale", "turnover",
+                   "kmwork", "kmprivate", "workdays", "offdays"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT NOT NULL", "INTEGER NOT NULL", "INTEGER NOT NULL",
+                  "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
+                  "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
+                  "INTEGER DEFAULT 0", "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
+                  "INTEGER DEFAULT 0", "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
+                  "INTEGER DEFAULT 0", "INTEGER DEFAULT 0"),
+        "indexes": (("report_id",), ("calc_date", "employee_id"))
+    }
 
     def __init__(self):
         """
         Initialize Calculator
         """
-        self.model = {
-            "name": "reportcalculations",
-            "id": "calc_id",
-            "fields": ("calc_id", "calc_date", "report_id", "employee_id", "reports_calculated",
-                       "new_visit", "new_demo", "new_sale", "new_turnover",
-                       "recall_visit", "recall_demo", "recall_sale", "recall_turnover",
-                       "sas", "sas_turnover", "current", "demo", "sale", "turnover",
-                       "kmwork", "kmprivate", "workdays", "offdays"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "TEXT NOT NULL", "INTEGER NOT NULL", "INTEGER NOT NULL",
-                      "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
-                      "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0", "REAL DEFAULT 0",
-                      "INTEGER DEFAULT 0", "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
-                      "INTEGER DEFAULT 0", "REAL DEFAULT 0", "INTEGER DEFAULT 0", "INTEGER DEFAULT 0",
-                      "INTEGER DEFAULT 0", "INTEGER DEFAULT 0")
-        }
         self._totals = {}
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def result(self):
@@ -79,15 +77,9 @@ class ReportCalculator:
         Returns:
             bool indicating current has been set for the requested id
         """
-        filters = [(self.model["id"], "=")]
-        values = (calc_id,)
-
-        sql = self.q.build("select", self.model, filters=filters)
-
-        success, data = self.q.execute(sql, values=values)
-
-        if success and data:
-            self._totals = dict(zip(self.model["fields"], data[0]))
+        totals = self.select_id(calc_id)
+        if totals is not None:
+            self._totals = totals
         return False
 
     def get_by_date_employee(self, workdate, employee_id):
@@ -100,32 +92,32 @@ class ReportCalculator:
         Returns:
             bool indicating current for the selected reportid is now set
         """
-        filters = [("workdate", "=", "and"), ("employee_id", "=")]
+        filters = [("calc_date", "=", "and"), ("employee_id", "=")]
         values = (workdate, employee_id)
 
         sql = self.q.build("select", self.model, filters=filters)
         success, data = self.q.execute(sql, values=values)
         if success and data:
-            self._totals = dict(zip(self.model["fields"], data[0]))
+            self._totals = self._row(*data[0])
         return False
 
     def insert(self, values):
         """
         Save values to database and sets current with the supplied values
         Args:
-            values:
+            values: calculation values without the calc_id
         """
-        values = list(values)
-        values[0:0] = [None]
-        values = tuple(values)
+        return super().insert((None,) + tuple(values))
 
-        sql = self.q.build("insert", self.model)
-
-        success, data = self.q.execute(sql, values=values)
-
-        if success and data:
-            return data
-        return False
+    def insert_many(self, rows):
+        """
+        Insert a batch of calculations in one transaction
+        Args:
+            rows: iterable of value tuples without the calc_id
+        Returns:
+            number of rows inserted
+        """
+        return super().insert_many((None,) + tuple(row) for row in rows)
 
     def update(self):
         """
@@ -134,24 +126,4 @@ class ReportCalculator:
         Returns:
             bool indicating if update was a success
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._totals.values())
-
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-
-        success, data = self.q.execute(sql, values=values)
-
-        if success and data:
-            return True
-        return False
-
-    def recreate_table(self):
-        """
-        Drop and init_detail table
-        """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
+        return self.update_row(self._totals)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Cache for select results invalidated by table versions"""
+
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+__module__ = "result_cache"
+
+_READ = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+_WRITE = re.compile(r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM|"
+                    r"DROP\s+TABLE(?:\s+IF\s+EXISTS)?|ALTER\s+TABLE)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+
+def _table(name):
+    """
+    Table name without the main schema
+    """
+    name = name.lower()
+    return name[5:] if name.startswith("main.") else name
+
+
+@lru_cache(maxsize=1024)
+def tables_read(sql):
+    """
+    Tables a statement reads
+    Args:
+        sql:
+    Returns:
+        tuple of table names
+    """
+    return tuple(sorted({_table(name) for name in _READ.findall(sql)}))
+
+
+@lru_cache(maxsize=1024)
+def table_written(sql):
+    """
+    Table a statement changes
+    Args:
+        sql:
+    Returns:
+        table name or None - create index, pragma and vacuum leave the rows as they are
+    """
+    match = _WRITE.match(sql)
+    return _table(match.group(1)) if match else None
+
+
+class ResultCache:
+    """
+    Least recently used cache of select results
+    Every table has a version which is bumped by a write to it - an entry is
+    tagged with the versions of the tables it read and is stale once one has moved
+    Writes inside a transaction block bump their tables again at commit
+    """
+
+    def __init__(self, size=256, max_rows=1000):
+        """
+        Initialize ResultCache
+        Args:
+            size: max number of results kept
+            max_rows: larger results are not kept
+        """
+        self._size = size
+        self._max_rows = max_rows
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._pending = set()
+        self._generation = 0  # moved by clear - results read before it are not stored
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+
+    @property
+    def stats(self):
+        """
+        Cache counters
+        Returns:
+            dict with hits, misses, stale and size
+        """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "stale": self._stale, "size": len(self._entries)}
+
+    def versions(self, sql):
+        """
+        Current versions of the tables a select reads
+        Take them before the select runs and hand them to put
+        Args:
+            sql:
+        Returns:
+            tuple with the cache generation and the versions
+        """
+        with self._lock:
+            return self.__current(sql)
+
+    def get(self, sql, values=None):
+        """
+        Lookup a result
+        Args:
+            sql:
+            values:
+        Returns:
+            copy of the rows or None
+        """
+        key = self.__key(sql, values)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            versions, rows = entry
+            if versions != self.__current(sql):
+                del self._entries[key]
+                self._stale += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return list(rows)
+
+    def put(self, sql, values, rows, versions):
+        """
+        Store a result
+        Args:
+            sql:
+            values:
+            rows: list of row tuples
+            versions: table versions taken before the select ran
+        """
+        key = self.__key(sql, values)
+        if key is None or len(rows) > self._max_rows:
+            return
+        with self._lock:
+            if versions[0] != self._generation:
+                return
+            self._entries[key] = (versions, list(rows))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def written(self, sql, pending=False):
+        """
+        Bump the version of the table a statement changed
+        Args:
+            sql:
+            pending: the statement ran inside a transaction block - bumped again at commit
+        """
+        table = table_written(sql)
+        if table:
+            self.touch(table, pending=pending)
+
+    def touch(self, *tables, pending=False):
+        """
+        Bump table versions - for changes made outside Query.execute
+        Args:
+            tables: table names
+            pending: see written
+        """
+        with self._lock:
+            for table in tables:
+                table = _table(table)
+                self._versions[table] = self._versions.get(table, 0) + 1
+                if pending:
+                    self._pending.add(table)
+
+    def commit(self):
+        """
+        A transaction block was committed - readers may have cached the rows from before it
+        """
+        with self._lock:
+            tables, self._pending = self._pending, set()
+        self.touch(*tables)
+
+    def clear(self):
+        """
+        Drop all results - the versions keep counting
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._pending = set()
+
+    def __current(self, sql):
+        """
+        Generation and versions of the tables a select reads - call with the lock held
+        """
+        return (self._generation,) + tuple(self._versions.get(table, 0) for table in tables_read(sql))
+
+    @staticmethod
+    def __key(sql, values):
+        """
+        Hashable key for a statement and its values
+        None for a statement which is not cached
+        """
+        tables = tables_read(sql)
+        # the schema tables and pragma functions change without a write the cache sees
+        if not tables or any(table.startswith(("sqlite_", "pragma_")) for table in tables):
+            return None
+        key = (sql, tuple(values) if values else ())
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
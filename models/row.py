@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Row record module"""
+
+import keyword
+import threading
+
+__module__ = "row"
+
+_RESERVED = ("copy", "get", "items", "keys", "values")
+_classes = {}
+_lock = threading.Lock()
+
+
+class Row:
+    """
+    Base for the compact row records generated from a model definition
+    Values are stored in __slots__ and read and written with mapping syntax
+    so a row can be used where a dict(zip(fields, row)) was used before
+    """
+    __slots__ = ()
+    _fields = ()
+    _fieldset = frozenset()
+
+    def __getitem__(self, key):
+        if key not in self._fieldset:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fieldset:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fieldset
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._fields == other._fields and self.values() == other.values()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__,
+                               ", ".join("{}={!r}".format(field, getattr(self, field)) for field in self._fields))
+
+    __hash__ = None
+
+    def copy(self):
+        """
+        Shallow copy
+        """
+        return type(self)(*self.values())
+
+    def get(self, key, default=None):
+        """
+        Value for key or default
+        """
+        if key not in self._fieldset:
+            return default
+        return getattr(self, key)
+
+    def items(self):
+        """
+        List of (field, value) in field order
+        """
+        return [(field, getattr(self, field)) for field in self._fields]
+
+    def keys(self):
+        """
+        Field names in field order
+        """
+        return list(self._fields)
+
+    def values(self):
+        """
+        Values in field order
+        """
+        return [getattr(self, field) for field in self._fields]
+
+
+def row_class(model):
+    """
+    Record class for a model definition
+    The class is generated once per table and field list
+    Args:
+        model: table model definition
+
+    Returns:
+        Row subclass taking the field values as positional arguments
+    """
+    fields = tuple(model["fields"])
+    key = (model["name"], fields)
+    cls = _classes.get(key)
+    if cls is not None:
+        return cls
+    for field in fields:
+        if not field.isidentifier() or keyword.iskeyword(field) or field in _RESERVED:
+            raise ValueError("Field name cannot be used as row attribute: {}".format(field))
+    # like collections.namedtuple the initializer is generated
+    # a single positional call is much cheaper than a loop of setattr
+    args = ", ".join("{}=None".format(field) for field in fields)
+    body = "\n".join("    self.{0} = {0}".format(field) for field in fields) or "    pass"
+    namespace = {}
+    exec("def __init__(self, {}):\n{}".format(args, body), namespace)
+    name = "".join(part.capitalize() for part in model["name"].split("_")) + "Row"
+    cls = type(name, (Row,), {"__slots__": fields,
+                              "__init__": namespace["__init__"],
+                              "_fields": fields,
+                              "_fieldset": frozenset(fields)})
+    with _lock:
+        cls = _classes.setdefault(key, cls)
+    return cls
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Schema registry module"""
+
+import sqlite3
+import threading
+
+from models.builders.build_create_query import build_create_query
+from models.builders.build_index_query import build_index_query, index_name
+from models.migration import SchemaMigrator, VERSION_MODEL, VERSION_TABLE, definition
+
+__module__ = "schema"
+
+
+class SchemaRegistry:
+    """
+    Known tables, indexes and table versions
+    sqlite_master is read once - later checks are answered from memory
+    A table whose recorded definition differs from its model is migrated
+    """
+
+    def __init__(self):
+        """
+        Initialize SchemaRegistry class
+        """
+        self._lock = threading.RLock()
+        self._tables = None
+        self._indexes = None
+        self._versions = {}
+        self._ensured = set()
+        self._migrator = SchemaMigrator()
+
+    @property
+    def versions(self):
+        """
+        Recorded table versions
+        Returns:
+            dict of table name with version
+        """
+        with self._lock:
+            return {name: version for name, (version, text) in self._versions.items()}
+
+    def load(self, db):
+        """
+        Read tables and indexes from sqlite_master
+        Args:
+            db: sqlite3 connection
+        """
+        with self._lock:
+            rows = db.execute("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'index');").fetchall()
+            self._tables = {name for kind, name in rows if kind == "table"}
+            self._indexes = {name for kind, name in rows if kind == "index"}
+            self._versions = {}
+            if VERSION_TABLE in self._tables:
+                self._versions = self._migrator.versions(db)
+
+    def ensure(self, db, model):
+        """
+        Create table and indexes for model if missing
+        Migrate the table if the model has changed since it was recorded
+        Args:
+            db: sqlite3 connection
+            model: table model definition
+        Returns:
+            bool indicating if anything was created
+        """
+        name = model["name"]
+        if name in self._ensured:
+            return False
+        with self._lock:
+            if name in self._ensured:
+                return False
+            if self._tables is None:
+                self.load(db)
+            created = False
+            if VERSION_TABLE not in self._tables:
+                db.execute(build_create_query(VERSION_MODEL))
+                self._tables.add(VERSION_TABLE)
+            version, text = self._versions.get(name, (0, None))
+            if name not in self._tables:
+                db.execute(build_create_query(model))
+                self._migrator.record(db, model, version + 1)
+                self._versions[name] = (version + 1, definition(model))
+                self._tables.add(name)
+                created = True
+            elif text != definition(model):
+                action, version = self._migrator.migrate(db, model, version)
+                self._versions[name] = (version, definition(model))
+                if action == "rebuild":
+                    # the indexes went with the old table - created again below
+                    self._indexes.difference_update(index_name(model, index) for index in model.get("indexes", ()))
+                created = action != "current"
+            for index in model.get("indexes", ()):
+                idx_name = index_name(model, index)
+                if idx_name not in self._indexes:
+                    try:
+                        db.execute(build_index_query(model, index))
+                    except sqlite3.DatabaseError:
+                        # e.g. existing rows violating a unique index - the table stays usable
+                        continue
+                    self._indexes.add(idx_name)
+                    created = True
+            self._ensured.add(name)
+            return created
+
+    def exists(self, db, table):
+        """
+        Check if table is known
+        Args:
+            db: sqlite3 connection
+            table: table name
+        Returns:
+            bool
+        """
+        with self._lock:
+            if self._tables is None:
+                self.load(db)
+            return table in self._tables
+
+    def reset(self):
+        """
+        Forget everything - next check reads sqlite_master again
+        """
+        with self._lock:
+            self._tables = None
+            self._indexes = None
+            self._ensured = set()
@@ -8,45 +8,53 @@
 settings module
 """
 
+import threading
+
+from configuration import config
+from models.model import Model
 from models.query import Query
 
 __module__ = "settings"
 
 
-class Settings:
+class Settings(Model):
     """
     settings class
+    Writes are held back for config.SETTINGS_FLUSH_DELAY and merged - the fields
+    changed since the last write are then written in one statement on a timer thread
+    Call flush before code reading the settings through another instance
     """
+    model = {
+        "name": "settings",
+        "id": "settings_id",
+        "fields": ("settings_id",
+                   "usermail", "userpass", "usercountry",
+                   "pd", "pf", "sf",
+                   "http", "smtp", "port", "mailto",
+                   "mailserver", "mailport", "mailuser", "mailpass",
+                   "fc", "fp", "fe",
+                   "lsc", "lsp", "sac", "sap", "sc",
+                   "cust_idx", "page_idx"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL",
+                  "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT", "TEXT",
+                  "INTEGER", "INTEGER", "INTEGER")
+    }
 
     def __init__(self):
         """
         Initialize the settings class
         """
-        self.model = {
-            "name": "settings",
-            "id": "settings_id",
-            "fields": ("settings_id",
-                       "usermail", "userpass", "usercountry",
-                       "pd", "pf", "sf",
-                       "http", "smtp", "port", "mailto",
-                       "mailserver", "mailport", "mailuser", "mailpass",
-                       "fc", "fp", "fe",
-                       "lsc", "lsp", "sac", "sap", "sc",
-                       "cust_idx", "page_idx"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL",
-                      "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT", "TEXT",
-                      "INTEGER", "INTEGER", "INTEGER")
-        }
         self._settings = {}
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        self._saved = {}  # values as last read from or written to the table
+        self._timer = None
+        self._lock = threading.Lock()  # guards the timer
+        self._write_lock = threading.Lock()  # one flush at a time
+        super().__init__()
 
     @property
     def settings(self):
@@ -75,8 +83,11 @@ class Settings:
     def get(self):
         """
         Load current
+        Pending changes are written first - if that fails the unwritten values are kept
         """
-        sql = self.q.build("select", self.model)
+        if not self.flush():
+            return
+        sql = self._sql["select"]
 
         success, data = self.q.execute(sql)
         if success and not data:
@@ -92,17 +103,71 @@ class Settings:
             success, data = self.q.execute(sql)
 
         if success and data:
-            self._settings = dict(zip(self.model["fields"], data[0]))
+            self._settings = self._row(*data[0])
+            self._saved = dict(self._settings.items())
 
     def update(self):
         """
         Update current
+        The write is queued - updates within config.SETTINGS_FLUSH_DELAY are merged
+        """
+        with self._lock:
+            if self._timer is None:
+                # not a daemon - a pending write is finished before the interpreter exits
+                self._timer = threading.Timer(config.SETTINGS_FLUSH_DELAY, self.__flush_behind)
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write the changed fields now
+        Returns:
+            bool
+        """
+        self.__cancel()
+        with self._write_lock:
+            current = self._settings
+            row_id = current.get(self.model["id"])
+            if row_id is None:
+                return True
+            changed = [(field, current[field]) for field in self.model["fields"][1:]
+                       if field in current and (field not in self._saved or self._saved[field] != current[field])]
+            if not changed:
+                return True
+            # the statement cache keeps one update per combination of changed fields
+            sql = self.q.build("update", self.model, update=[field for field, _ in changed],
+                               filters=[(self.model["id"], "=")])
+            success, data = self.q.execute(sql, values=tuple(value for _, value in changed) + (row_id,))
+            if success:
+                self._saved.update(changed)
+            return success
+
+    def discard(self):
+        """
+        Drop pending changes and forget the loaded values
+        Used when the database is replaced - the next read loads the settings of the new one
+        """
+        self.__cancel()
+        with self._write_lock:
+            self._settings = {}
+            self._saved = {}
+
+    def __cancel(self):
+        """
+        Stop a pending write
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+
+    def __flush_behind(self):
+        """
+        Timer callback - the write runs on the timer thread
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._settings.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        self.q.execute(sql, values=values)
+        with self._lock:
+            self._timer = None
+        self.flush()
+        Query.release()
 
     def __insert(self, values):
         """
@@ -113,6 +178,5 @@ class Settings:
         Returns:
 
         """
-        sql = self.q.build("insert", self.model)
-        self.q.execute(sql, values=values)
-        self._settings = dict(zip(self.model["fields"], values))
+        self.insert(values)
+        self._settings = self._row(*values)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Template database module
+
+A database file with every table, index and file pragma of the models
+A first run copies it into place instead of creating the tables one by one
+
+    python -m models.template [path]
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import zlib
+
+from configuration import config
+from models.builders.build_index_query import build_index_query
+from models.migration import definition
+from models.model import Model
+from models.schema import SchemaRegistry
+# the model modules register their classes with Model.models
+from models import contact, customer, customerproducts, employee, orderline  # noqa: F401
+from models import product, report, reportcalculator, settings, visit  # noqa: F401
+
+__module__ = "template"
+
+PERSISTENT = ("auto_vacuum", "journal_mode")  # pragmas stored in the database file
+
+
+def models():
+    """
+    Model definitions in the template
+    Returns:
+        list of models ordered by table name
+    """
+    return sorted((cls.model for cls in Model.models), key=lambda model: model["name"])
+
+
+def pragmas():
+    """
+    File pragmas of the active profile
+    Returns:
+        list of (pragma, value)
+    """
+    return [(pragma, value) for pragma, value in config.DB_PROFILES[config.DB_PROFILE] if pragma in PERSISTENT]
+
+
+def version():
+    """
+    Version of the template for the current models
+    Changes with any table, index or file pragma
+    Returns:
+        positive integer kept in PRAGMA user_version
+    """
+    text = [definition(model) for model in models()]
+    text += [build_index_query(model, index) for model in models() for index in model.get("indexes", ())]
+    text += ["PRAGMA {}={};".format(pragma, value) for pragma, value in pragmas()]
+    return zlib.crc32("\n".join(text).encode("utf-8")) & 0x7fffffff
+
+
+def current(path):
+    """
+    Check if a template file matches the current models
+    Args:
+        path: template file
+    Returns:
+        bool
+    """
+    if not os.path.isfile(path):
+        return False
+    try:
+        db = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+        try:
+            return db.execute("PRAGMA user_version;").fetchone()[0] == version()
+        finally:
+            db.close()
+    except sqlite3.DatabaseError:
+        return False
+
+
+def build(path):
+    """
+    Write a template database
+    Args:
+        path: template file - replaced when complete
+    Returns:
+        path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    part = "{}.part".format(path)
+    if os.path.exists(part):
+        os.remove(part)
+    db = sqlite3.connect(part, isolation_level=None)
+    try:
+        # file pragmas first - auto_vacuum only takes before the first table
+        for pragma, value in pragmas():
+            db.execute("PRAGMA {}={};".format(pragma, value))
+        registry = SchemaRegistry()
+        db.execute("BEGIN;")
+        for model in models():
+            registry.ensure(db, model)
+        db.execute("PRAGMA user_version={};".format(version()))
+        db.execute("COMMIT;")
+    finally:
+        db.close()
+    os.replace(part, path)
+    return path
+
+
+def install(target=None):
+    """
+    Put a copy of the template in place of a missing database
+    The shipped template is used when it matches the models - otherwise
+    a template is built once in config.TEMPLATE_CACHE
+    Args:
+        target: database file - default config.DBPATH
+    Returns:
+        bool indicating if the template was copied
+    """
+    target = target or config.DBPATH
+    if os.path.exists(target):
+        return False
+    template = config.TEMPLATE_PATH
+    if not current(template):
+        template = config.TEMPLATE_CACHE
+        if not current(template):
+            build(template)
+    part = "{}.part".format(target)
+    shutil.copyfile(template, part)
+    os.replace(part, target)
+    return True
+
+
+def main(args):
+    """
+    Build the template shipped with the app
+    Args:
+        args: optional template path
+    """
+    path = build(args[0] if args else config.TEMPLATE_PATH)
+    print("{} version {}".format(path, version()))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
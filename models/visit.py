@@ -8,47 +8,46 @@
 Visit module
 """
 
-from models.query import Query
+from configuration import config
+from models.model import Model
 from util import utils
 
 __module__ = "visit"
 
 
-class Visit:
+class Visit(Model):
     """
     Visit class
     """
+    model = {
+        "name": "visits",
+        "id": "visit_id",
+        "fields": ("visit_id", "report_id", "employee_id", "customer_id",
+                   "visit_date", "po_sent",
+                   "po_buyer", "po_number", "po_company", "po_address1", "po_address2",
+                   "po_postcode", "po_postoffice", "po_country",
+                   "po_note", "prod_demo", "prod_sale", "visit_type",
+                   "po_sas", "po_sale", "po_total", "po_approved", "visit_note"),
+        "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "INTEGER NOT NULL", "INTEGER NOT NULL",
+                  "TEXT NOT NULL", "INTEGER DEFAULT 0",
+                  "TEXT", "TEXT", "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT",
+                  "TEXT", "TEXT", "TEXT", "TEXT NOT NULL",
+                  "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0",
+                  "INTEGER DEFAULT 0", "TEXT"),
+        "indexes": (("customer_id", "visit_date"), ("visit_date",), ("report_id",))
+    }
 
     def __init__(self):
         """
         Initialize current class
         """
-        self.model = {
-            "name": "visits",
-            "id": "visit_id",
-            "fields": ("visit_id", "report_id", "employee_id", "customer_id",
-                       "visit_date", "po_sent",
-                       "po_buyer", "po_number", "po_company", "po_address1", "po_address2",
-                       "po_postcode", "po_postoffice", "po_country",
-                       "po_note", "prod_demo", "prod_sale", "visit_type",
-                       "po_sas", "po_sale", "po_total", "po_approved", "visit_note"),
-            "types": ("INTEGER PRIMARY KEY NOT NULL", "INTEGER NOT NULL", "INTEGER NOT NULL", "INTEGER NOT NULL",
-                      "TEXT NOT NULL", "INTEGER DEFAULT 0",
-                      "TEXT", "TEXT", "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT",
-                      "TEXT", "TEXT", "TEXT", "TEXT NOT NULL",
-                      "REAL DEFAULT 0", "REAL DEFAULT 0", "REAL DEFAULT 0",
-                      "INTEGER DEFAULT 0", "TEXT")
-        }
         self._visit = {}
         self._visits = []
         self._visits = []
         self._visits = []
         self._csv_record_length = 22
-        self.q = Query()
-        if not self.q.exist_table(self.model["name"]):
-            sql = self.q.build("create", self.model)
-            self.q.execute(sql)
+        super().__init__()
 
     @property
     def csv_record_length(self):
@@ -78,6 +77,7 @@ class Visit:
     def list_by_customer(self, customer_id):
         """
         Load the list of visits for a given customer
+        Visits of the last config.ARCHIVE_LIST_YEARS archived years are included
         Args:
             customer_id:
         """
@@ -86,26 +86,31 @@ class Visit:
     def list_by_date(self, visit_date):
         """
         Load the list of visits for a given date
+        The archive of the year is read when the year is archived
         Args:
              visit_date:
         """
         self.__get_by_date(visit_date)
 
-    def list_by_report_id(self, report_id):
+    def list_by_report_id(self, report_id, rep_date=None):
         """
         Load the list of visits for a given report
+        The archive is read when rep_date is in an archived year - ids may be reused after archiving
         Args:
             report_id:
+            rep_date: date of the report
         """
-        self.__get_by_report_id(report_id)
+        self.__get_by_report_id(report_id, rep_date)
 
-    def load_visit(self, visit_id):
+    def load_visit(self, visit_id, visit_date=None):
         """
         Load a visit
+        The archive is read when visit_date is in an archived year - ids may be reused after archiving
         Args:
             visit_id:
+            visit_date: date of the visit
         """
-        self.__get(visit_id)
+        self.__get(visit_id, visit_date)
 
     def add(self, report_id, employee_id, customer_id, workdate):
         """
@@ -135,41 +140,23 @@ class Visit:
         """
         Delete the specified visit
         :param visit_id:
-        :return:
-        """
-        filters = [(self.model["id"], "=")]
-        values = (visit_id,)
-        sql = self.q.build("delete", self.model, filters)
-        self.q.execute(sql, values)
-
-    def insert(self, values):
-        """
-        Insert a new row in the database
-        :param values:
-        :return: rownumber on success or None
+        :return: True on success
         """
-        sql = self.q.build("insert", self.model)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
-        return None
+        success, data = self.q.execute(self._sql["delete_id"], (visit_id,))
+        return success
 
-    def recreate_table(self):
+    def translate_row_insert(self, row):
         """
-        Recreate table
+        Translate a csv row and insert it
+        :param row:
         """
-        sql = self.q.build("drop", self.model)
-        self.q.execute(sql)
-        sql = self.q.build("create", self.model)
-        self.q.execute(sql)
-        self.clear()
+        self.insert(self.translate_row(row))  # call insert function
 
-    def translate_row_insert(self, row):
+    def translate_row(self, row):
         """
         Translate a csv row
-        :rtype: bool
         :param row:
-        :return: True / False
+        :return: tuple with values for insert
         """
         # translate bool text to integer col 5
         field_5 = utils.bool2int(utils.arg2bool(row[5]))
@@ -178,39 +165,32 @@ class Visit:
                    row[10].strip(), row[11].strip(), row[12].strip(), row[13].strip(), row[14].strip(),
                    row[15].strip(), row[16].strip(), row[17].strip(), row[18], row[19],
                    row[20], row[21], row[14].strip())
-        self.insert(new_row)  # call insert function
+        return new_row
 
     def update(self):
         """
         Write visit changes to database
-        :return: rownumber on success or None
+        :return: True on success
         """
-        fields = list(self.model["fields"])[1:]
-        filters = [(self.model["id"], "=")]
-        values = self.q.values_to_update(self._visit.values())
-        sql = self.q.build("update", self.model, update=fields, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success and data:
-            return data
-        return None
+        return self.update_row(self._visit)
 
-    def __get(self, visit_id):
+    def __get(self, visit_id, visit_date=None):
         """
         Find the specified visit
         :param visit_id:
+        :param visit_date:
         :return: True on success
         """
-        filters = [(self.model["id"], "=")]
-        values = (visit_id,)
-        sql = self.q.build("select", self.model, filters=filters)
-        success, data = self.q.execute(sql, values=values)
-        if success:
-            try:
-                self._visit = dict(zip(self.model["fields"], data[0]))
-                return True
-            except IndexError:
-                self._visit = {}
-        return False
+        visit = None
+        years = self.q.archives.between(visit_date, visit_date) if visit_date else []
+        if years:
+            data = self.q.archives.select(self.model, filters=[(self.model["id"], "=")], values=(visit_id,),
+                                          years=years)
+            visit = self._row(*data[0]) if data else None
+        if visit is None:
+            visit = self.select_id(visit_id) or {}
+        self._visit = visit
+        return bool(self._visit)
 
     def __get_by_customer(self, customer_id, visit_date=None):
         """
@@ -228,8 +208,15 @@ class Visit:
         sql = self.q.build("select", self.model, filters=filters)
         success, data = self.q.execute(sql, values=values)
         if success:
+            if visit_date:
+                years = self.q.archives.between(visit_date, visit_date)
+            else:
+                # the years listed - every archive is not attached for each customer
+                years = self.q.archives.between("{}-01-01".format(
+                    self.q.archives.closed() - config.ARCHIVE_LIST_YEARS))
+            data = data + self.q.archives.select(self.model, filters=filters, values=values, years=years)
             try:
-                self._visits = [dict(zip(self.model["fields"], row)) for row in data]
+                self._visits = [self._row(*row) for row in data]
                 self._visit = self._visits[0]
             except (IndexError, KeyError):
                 self._visit = {}
@@ -246,25 +233,32 @@ class Visit:
         sql = self.q.build("select", self.model, filters=filters)
         success, data = self.q.execute(sql, values=values)
         if success:
+            data = data + self.q.archives.select(self.model, filters=filters, values=values,
+                                                 years=self.q.archives.between(visit_date, visit_date))
             try:
-                self._visits = dict(zip(self.model["fields"], data[0]))
+                self._visits = [self._row(*row) for row in data]
                 self._visit = self._visits[0]
-            except IndexError:
+            except (IndexError, KeyError):
                 self._visit = {}
                 self._visits = []
 
-    def __get_by_report_id(self, report_id):
+    def __get_by_report_id(self, report_id, rep_date=None):
         """
         Load visit_list_customer for specified report
         :param: report_id
+        :param: rep_date
         """
         filters = [("report_id", "=")]
         values = (report_id,)
         sql = self.q.build("select", self.model, filters=filters)
         success, data = self.q.execute(sql, values=values)
         if success:
+            years = self.q.archives.between(rep_date, rep_date) if rep_date else []
+            if years:
+                # visits of a report from an archived year - the table holds visits of a report created since
+                data = self.q.archives.select(self.model, filters=filters, values=values, years=years) or data
             try:
-                self._visits = [dict(zip(self.model["fields"], row)) for row in data]
+                self._visits = [self._row(*row) for row in data]
                 self._visit = self._visits[0]
             except (IndexError, KeyError):
                 self._visit = {}
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright: Frede Hundewadt <echo "ZmhAdWV4LmRrCg==" | base64 -d>
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""Query profiler tests"""
+
+from configuration import config
+from models.customer import Customer
+from models.profiler import percentile
+from models.query import Query
+
+
+def test_percentile_nearest_rank():
+    """
+    The percentile is the value at rank ceil(pct / 100 * n)
+    """
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile(list(range(1, 21)), 95) == 19
+    assert percentile([1, 2, 3, 4], 0) == 1
+    assert percentile([1, 2, 3, 4], 100) == 4
+    assert percentile([], 50) == 0.0
+
+
+def test_statement_attributed_to_calling_model(monkeypatch):
+    """
+    A statement issued through the Model base class is reported for the model method calling it
+    """
+    monkeypatch.setattr(config, "QUERY_PROFILE", True)
+    monkeypatch.setattr(config, "SLOW_QUERY_MS", float("inf"))  # nothing written to the app log
+    Query.use_storage("memory")
+    try:
+        customers = Customer()
+        Query.profiler.clear()
+        customers.lookup_by_id(1)
+        callers = [caller for item in Query.profiler.summary() for caller in item["callers"]]
+        # the qualified name carries the class on python 3.11 and later
+        assert [caller for caller in callers
+                if caller.startswith("models.customer.") and caller.endswith("lookup_by_id")]
+        assert not [caller for caller in callers if caller.startswith("models.model.")]
+    finally:
+        Query.use_storage(config.DB_STORAGE)
+        Query.profiler.clear()
@@ -135,8 +135,6 @@ def item_price(item, pcs):
         return item["d6"]
     if num >= 4 and item["d4"] is not 0.0:
         return item["d4"]
-    if num >= 3 and item["d3"] is not 0.0:
-        return item["d3"]
     if num >= 2 and item["d2"] is not 0.0:
         return item["d2"]
     return item["price"]
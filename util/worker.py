@@ -9,8 +9,12 @@
 """Worker module"""
 
 import csv
+import time
 
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+from configuration import config
+from models.query import Query
 from util import httpFn
 
 __module__ = "worker"
@@ -23,12 +27,76 @@ class Worker(QObject):
 
     sig_status = pyqtSignal(int, str)  # worker id, progress: emitted every step through the file
     sig_done = pyqtSignal(int)  # worker id: emitted at end of the file
+    sig_progress = pyqtSignal(int, int)  # worker id, percent done
 
-    def __init__(self, thread_id: int, app):
+    def __init__(self, thread_id: int, app, args=()):
+        """
+        :param thread_id: int
+        :param app: object
+        :param args: tuple with the arguments of a slot connected to QThread.started - the
+                     signal carries none and a lambda would run the job on the gui thread
+        """
         super().__init__()
         self.__app = app
         self.__thread_id = thread_id
         self.__abort = False
+        self.__args = args
+
+    def __done(self):
+        """
+        Release the database connection of the worker thread and signal done
+        """
+        Query.release()
+        self.sig_done.emit(self.__thread_id)
+
+    @pyqtSlot(name="database_maintenance")
+    def database_maintenance(self):
+        """
+        Run the due database maintenance step by step
+        args: (maintenance object,)
+        :return:
+        """
+        maintenance, = self.__args
+        for step in maintenance.steps():
+            self.sig_status.emit(self.__thread_id, step)
+            time.sleep(config.DB_MAINTENANCE_PAUSE)  # other writers get the database between steps
+        self.__done()
+
+    @pyqtSlot(name="export_database")
+    def export_database(self):
+        """
+        Write a compressed backup of the database
+        args: (backup object, filename str)
+        :return:
+        """
+        backup, filename = self.__args
+        self.sig_status.emit(self.__thread_id, "Gemmer database backup ...")
+        success, result = backup.export(filename,
+                                        progress=lambda percent: self.sig_progress.emit(self.__thread_id, percent))
+        if success:
+            ftext = ">>> Backup er gemt i {}".format(result)
+        else:
+            ftext = "FEJL: Backup blev ikke gemt - {}".format(result)
+        self.sig_status.emit(self.__thread_id, ftext)
+        self.__done()
+
+    @pyqtSlot(name="import_database")
+    def import_database(self):
+        """
+        Replace the database with a backup
+        args: (backup object, filename str)
+        :return:
+        """
+        backup, filename = self.__args
+        self.sig_status.emit(self.__thread_id, "Indlæser database backup ...")
+        success, result = backup.restore(filename,
+                                         progress=lambda percent: self.sig_progress.emit(self.__thread_id, percent))
+        if success:
+            ftext = ">>> Database er indlæst fra {}".format(result)
+        else:
+            ftext = "FEJL: Database blev ikke indlæst - {}".format(result)
+        self.sig_status.emit(self.__thread_id, ftext)
+        self.__done()
 
     @pyqtSlot(name="import_contacts_csv")
     def import_contacts_csv(self, contacts, filename, header):
@@ -41,7 +109,7 @@ class Worker(QObject):
         """
         filename.encode("utf8")
         self.sig_status.emit(self.__thread_id, "{}".format("Forbereder indlæsning ..."))
-        contacts.recreate_table()
+        new_rows = []
         ftext = ">>> Import er færdig!"
         with open(filename) as csvdata:
             reader = csv.reader(csvdata, delimiter="|")
@@ -60,10 +128,13 @@ class Worker(QObject):
 
                 self.sig_status.emit(self.__thread_id, "{} - {}".format(row[2].strip(), row[3].strip()))
 
-                contacts.translate_row_insert(row)  # send row to database
+                new_rows.append(contacts.translate_row(row))  # queue row for database
+
+        with Query.profile("bulk_import"):
+            contacts.sync(new_rows)  # replace the contacts with the file in one transaction
 
         self.sig_status.emit(self.__thread_id, "{}".format(ftext))
-        self.sig_done.emit(self.__thread_id)
+        self.__done()
 
     @pyqtSlot(name="import_customers_csv")
     def import_customers_csv(self, customers, filename, header):
@@ -77,6 +148,7 @@ class Worker(QObject):
         filename.encode("utf8")
         self.sig_status.emit(self.__thread_id, "{}".format("Forbereder indlæsning ..."))
         customers.recreate_table()
+        new_rows = []
         ftext = ">>> Import er færdig!"
         with open(filename) as csvdata:
             reader = csv.reader(csvdata, delimiter="|")
@@ -94,10 +166,13 @@ class Worker(QObject):
 
                 self.sig_status.emit(self.__thread_id, "{} - {}".format(row[1].strip(), row[2].strip()))
 
-                customers.translate_row_insert(row)  # send row to database
+                new_rows.append(customers.translate_row(row))  # queue row for database
+
+        with Query.profile("bulk_import"):
+            customers.insert_many(new_rows)  # send rows to database in one transaction
 
         self.sig_status.emit(self.__thread_id, "{}".format(ftext))
-        self.sig_done.emit(self.__thread_id)
+        self.__done()
 
     @pyqtSlot(name="import_customers_http")
     def import_customers_http(self, customers, employees, settings):
@@ -112,15 +187,19 @@ class Worker(QObject):
         self.sig_status.emit(self.__thread_id, "{}".format("Henter fra server ..."))
 
         data = httpFn.get_customers(settings, employees)     # fetch datafile from http server
+        new_rows = []
         for row in data:                                     # data processing
 
             self.__app.processEvents()
 
             self.sig_status.emit(self.__thread_id, "{} - {}".format(row[0], row[1]))
 
-            customers.import_http(row)                       # init_detail row to database
+            new_rows.append(row)                             # queue row for database
 
-        self.sig_done.emit(self.__thread_id)
+        with Query.profile("bulk_import"):
+            customers.import_http_many(new_rows)             # insert or update by account in one transaction
+
+        self.__done()
 
     @pyqtSlot(name="import_order_lines_csv")
     def import_orderlines_csv(self, orderlines, filename, header):
@@ -134,6 +213,7 @@ class Worker(QObject):
         filename.encode("utf8")
         self.sig_status.emit(self.__thread_id, "{}".format("Forbereder indlæsning ..."))
         orderlines.recreate_table()
+        new_rows = []
         ftext = ">>> Import er færdig!"
         with open(filename) as csvdata:
             reader = csv.reader(csvdata, delimiter="|")
@@ -151,10 +231,13 @@ class Worker(QObject):
 
                 self.sig_status.emit(self.__thread_id, "{} - {}".format(row[2].strip(), row[3].strip()))
 
-                orderlines.translate_row_insert(row)              # send row to database
+                new_rows.append(orderlines.translate_row(row))  # queue row for database
+
+        with Query.profile("bulk_import"):
+            orderlines.insert_many(new_rows)  # send rows to database in one transaction
 
         self.sig_status.emit(self.__thread_id, "{}".format(ftext))
-        self.sig_done.emit(self.__thread_id)
+        self.__done()
 
     @pyqtSlot(name="import_products_http")
     def import_products_http(self, products, settings):
@@ -164,18 +247,20 @@ class Worker(QObject):
         :param settings:
         """
         self.sig_status.emit(self.__thread_id, "{}".format("Forbereder hentning ..."))
-        products.drop_table()                               # drop product table
         self.sig_status.emit(self.__thread_id, "{}".format("Henter fra server ..."))
         data = httpFn.get_products(settings)                # fetching datafile using http with settings
+        new_rows = []
         for row in data:                                    # process the data
 
             self.__app.processEvents()
 
             self.sig_status.emit(self.__thread_id, "{} - {}".format(row[0], row[1]))
 
-            products.insert(row)                            # send row to database
+            new_rows.append(row)                            # queue row for database
 
-        self.sig_done.emit(self.__thread_id)
+        with Query.profile("bulk_import"):
+            products.sync(new_rows)                         # merge rows by sku in one transaction
+        self.__done()
 
     @pyqtSlot(name="import_reports_csv")
     def import_reports_csv(self, employeeid, reports, filename, header):
@@ -190,6 +275,7 @@ class Worker(QObject):
         filename.encode("utf8")
         self.sig_status.emit(self.__thread_id, "{}".format("Forbereder indlæsning ..."))
         reports.recreate_table()
+        new_rows = []
         ftext = ">>> Import er færdig!"
         with open(filename) as csvdata:
             reader = csv.reader(csvdata, delimiter="|")
@@ -208,10 +294,13 @@ class Worker(QObject):
 
                 self.sig_status.emit(self.__thread_id, "{} - {}".format(row[2].strip(), row[3].strip()))
 
-                reports.translate_row_insert(row, employeeid)  # send row to database
+                new_rows.append(reports.translate_row(row, employeeid))  # queue row for database
+
+        with Query.profile("bulk_import"):
+            reports.insert_many(new_rows)  # send rows to database in one transaction
 
         self.sig_status.emit(self.__thread_id, "{}".format(ftext))
-        self.sig_done.emit(self.__thread_id)
+        self.__done()
 
     @pyqtSlot(name="import_visits_csv")
     def import_visits_csv(self, visits, filename, header):
@@ -225,6 +314,7 @@ class Worker(QObject):
         filename.encode("utf8")
         self.sig_status.emit(self.__thread_id, "{}".format("Forbereder indlæsning ..."))
         visits.recreate_table()
+        new_rows = []
         ftext = ">>> Import er færdig!"
         with open(filename) as csvdata:
             reader = csv.reader(csvdata, delimiter="|")
@@ -242,7 +332,10 @@ class Worker(QObject):
 
                 self.sig_status.emit(self.__thread_id, "{} - {}".format(row[2].strip(), row[3].strip()))
 
-                visits.translate_row_insert(row)                  # send row to database
+                new_rows.append(visits.translate_row(row))  # queue row for database
+
+        with Query.profile("bulk_import"):
+            visits.insert_many(new_rows)  # send rows to database in one transaction
 
         self.sig_status.emit(self.__thread_id, "{}".format(ftext))
-        self.sig_done.emit(self.__thread_id)
+        self.__done()